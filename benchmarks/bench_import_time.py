@@ -0,0 +1,65 @@
+"""
+Measures the cold-import time of the servicemon and navoutils modules used by
+short-lived monitoring probes, and reports which heavy dependencies each one
+pulls in.
+
+Each import is timed in a fresh interpreter (run from servicemon/, as the
+scripts there are), and the median of several runs is reported.  With
+--max-ms, exits with status 1 if any module takes longer than that, so the
+benchmark can guard against regressions.
+
+Usage:  python benchmarks/bench_import_time.py [--runs N] [--max-ms MS] [module ...]
+"""
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+
+SERVICEMON_DIR = pathlib.Path(__file__).resolve().parent.parent / 'servicemon'
+
+DEFAULT_MODULES = ['query', 'navoutils.sessions', 'navoutils.utils']
+
+HEAVY_MODULES = ['astropy.table', 'astropy.coordinates', 'astroquery', 'IPython']
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed,
+                   'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def time_import(module):
+    out = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                         cwd=str(SERVICEMON_DIR), stdout=subprocess.PIPE, check=True,
+                         universal_newlines=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    too_slow = []
+    for module in args.modules:
+        results = [time_import(module) for _ in range(args.runs)]
+        ms = 1000 * statistics.median(r['seconds'] for r in results)
+        heavy = ', '.join(results[0]['heavy']) or '-'
+        print(f'{module:24s} {ms:9.1f} ms   heavy imports: {heavy}')
+        if args.max_ms is not None and ms > args.max_ms:
+            too_slow.append(module)
+
+    if too_slow:
+        print(f'Slower than {args.max_ms} ms: {", ".join(too_slow)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
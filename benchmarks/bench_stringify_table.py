@@ -0,0 +1,53 @@
+"""
+Compares navoutils.utils.stringify_table with the previous np.vectorize
+based conversion on a VOTable-like table of bytes-valued object columns.
+
+Usage:  python benchmarks/bench_stringify_table.py [num_rows]
+"""
+import pathlib
+import sys
+import timeit
+
+import numpy as np
+from astropy.table import Table, MaskedColumn
+
+REPO_DIR = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+from servicemon.navoutils import utils  # noqa: E402
+
+
+def make_table(num_rows):
+    t = Table()
+    for i in range(4):
+        values = np.empty(num_rows, dtype=object)
+        values[:] = [f'ivo://example/{i}/{j}'.encode('utf-8') for j in range(num_rows)]
+        t[f'col{i}'] = values
+    masked = np.empty(num_rows, dtype=object)
+    masked[:] = [b'x' * (j % 7) for j in range(num_rows)]
+    t['masked'] = MaskedColumn(masked, mask=(np.arange(num_rows) % 5 == 0))
+    t['ra'] = np.random.random(num_rows)
+    return t
+
+
+def old_stringify_table(t):
+    scols = [name for name in t.colnames
+             if t[name].dtype == 'object' and isinstance(t[name][0], bytes)]
+    for name in scols:
+        new_col = utils.svalv(t[name])
+        new_col.meta = t[name].meta
+        t[name] = new_col
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    template = make_table(num_rows)
+
+    for label, func in (('np.vectorize', old_stringify_table),
+                        ('stringify_table', utils.stringify_table)):
+        best = min(timeit.repeat(lambda: func(template.copy()), number=1, repeat=3))
+        print(f'{label:>16}: {best:.3f} s for {num_rows} rows')
+
+
+if __name__ == '__main__':
+    main()
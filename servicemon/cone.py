@@ -1,7 +1,5 @@
 import numpy as np
 from numpy.random import random_sample as rand
-from astropy import units as u
-from astropy.coordinates import SkyCoord
 
 class Cone:
     """
@@ -17,6 +15,9 @@ class Cone:
     def random_skycoord():
         """
         """
+        from astropy import units as u
+        from astropy.coordinates import SkyCoord
+
         ra_rad = (2 * np.pi * rand()) * u.rad
         dec_rad = np.arcsin(2. * (rand() - 0.5)) * u.rad
         
@@ -34,15 +35,54 @@ class Cone:
         return (skycoord, radius)
     
     @staticmethod
-    def generate_random(num_points, min_radius, max_radius):
+    def generate_random(num_points, min_radius, max_radius, seed=None):
+        """
+        Yields num_points (SkyCoord, radius) tuples.  The positions and radii
+        are drawn in one batch (see random_batch); seed makes the sequence
+        reproducible.
+        """
+        coords, radii = Cone.random_batch(num_points, min_radius, max_radius,
+                                          seed=seed, as_skycoord=True)
+        for i in range(num_points):
+            yield (coords[i], radii[i])
+
+    @staticmethod
+    def random_batch(num_points, min_radius, max_radius, seed=None, as_skycoord=False):
+        """
+        Draws num_points cones uniformly distributed on the sky, with radii
+        uniform in [min_radius, max_radius), using a single call to the
+        random number generator.
+
+        seed may be None, an int, or a numpy random Generator (or RandomState)
+        to draw from.  The same seed always gives the same cones.
+
+        Returns (ra, dec, radius) arrays, with ra and dec in degrees, or
+        (SkyCoord, radius) with a single vector SkyCoord if as_skycoord is True.
+        """
         if not (0 <= min_radius < max_radius):
             raise ValueError('min-radius must be in the range [0,max_radius).')
-        if num_point <= 0:
-            raise ValueError('num_point must be a positive number.')  
+        if num_points <= 0:
+            raise ValueError('num_points must be a positive number.')
         
-        for i in range(num_points):
-            cone = Cone.random_cone(min_radius, max_radius)
-            yield cone
+        samples = Cone._rng(seed).uniform(size=(3, num_points))
+        ra = 360. * samples[0]
+        dec = np.degrees(np.arcsin(2. * (samples[1] - 0.5)))
+        radius = (max_radius - min_radius) * samples[2] + min_radius
+
+        if as_skycoord:
+            from astropy import units as u
+            from astropy.coordinates import SkyCoord
+            return (SkyCoord(ra, dec, unit=u.deg), radius)
+        return (ra, dec, radius)
+
+    @staticmethod
+    def _rng(seed):
+        if isinstance(seed, np.random.RandomState):
+            return seed
+        if hasattr(np.random, 'default_rng'):
+            # Also passes an existing Generator through unchanged.
+            return np.random.default_rng(seed)
+        return np.random.RandomState(seed)
         
         
 
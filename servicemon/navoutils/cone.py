@@ -4,8 +4,6 @@ VO Queries
 """
 
 from astroquery.query import BaseQuery
-from astroquery.utils import parse_coordinates
-from astropy.coordinates import SkyCoord
 from . import utils
 
 
@@ -18,7 +16,7 @@ class ConeClass(BaseQuery):
         self._TIMEOUT = 60  # seconds to timeout
         self._RETRIES = 3  # total number of times to try
 
-    def query(self, service, coords, radius, verbose=False):
+    def query(self, service, coords, radius, verbose=False, max_workers=1):
         """Basic cone search query function
 
         Input coords should be either a single string, a single
@@ -31,12 +29,17 @@ class ConeClass(BaseQuery):
         Input service can be a string URL a single row
         of an astropy Table.
 
+        max_workers = the number of positions to query at once (default 1).
+        Results are in the order of coords either way; a position whose
+        query fails gives an empty table with the exception in
+        meta['error'].
+
         """
 
         if type(service) is str:
             service = {"access_url": service}
 
-        if type(coords) is str or isinstance(coords, SkyCoord):
+        if type(coords) is str or utils.is_skycoord(coords):
             coords = [coords]
         assert type(coords) is list, """
         ERROR: Give a coordinate object that is a single string,
@@ -46,27 +49,51 @@ class ConeClass(BaseQuery):
         if type(radius) is not list:
             inradius = [radius]*len(coords)
         else:
-            inradius = inradius
+            inradius = radius
             assert len(inradius) == len(coords), 'Please give either single radius or list of radii of same length as coords.'
 
         # Construct list of dictionaries, each with the parameters needed
         # for the function you're calling in the query_loop:
         params = [{'coords': c, 'radius': inradius[i]} for i, c in enumerate(coords)]
 
-        result_list = utils.query_loop(self._one_cone_search, service=service, params=params, verbose=verbose)
+        result_list = utils.query_loop(self._one_cone_search, service=service, params=params, verbose=verbose,
+                                       max_workers=max_workers)
         return result_list
 
+    def query_services(self, services, coords, radius, max_services=16, timeout=None, verbose=False, max_workers=1):
+        """Basic cone search of many services at once
+
+        Input services can be an astropy Table returned from
+        Registry.query() (or selected from it), or any list of services
+        or URLs that query() accepts. Up to max_services of them are
+        queried concurrently; the other arguments are as for query().
+
+        Returns a generator of utils.ServiceResult, one per service in the
+        order they finish, whose result is the list of tables query()
+        returns for that service, or whose error is the exception raised.
+
+        timeout = seconds after which a service that hasn't finished is
+        reported with a TimeoutError and no longer waited for, so one slow
+        archive doesn't hold up the rest (default None, no limit).
+
+        """
+        def search(service):
+            return self.query(service, coords, radius, verbose=verbose, max_workers=max_workers)
+
+        return utils.search_services(search, services, max_workers=max_services, timeout=timeout)
+
     def _one_cone_search(self, coords, radius, service):
         if (type(coords) is tuple or type(coords) is list) and len(coords) == 2:
-            coords = parse_coordinates("{} {}".format(coords[0], coords[1]))
+            coords = utils.parse_coordinates("{} {}".format(coords[0], coords[1]))
         elif type(coords) is str:
-            coords = parse_coordinates(coords)
+            coords = utils.parse_coordinates(coords)
         else:
-            assert isinstance(coords, SkyCoord), "ERROR: cannot parse input coordinates {}".format(coords)
+            assert utils.is_skycoord(coords), "ERROR: cannot parse input coordinates {}".format(coords)
 
         params = {'RA': coords.ra.deg, 'DEC': coords.dec.deg, 'SR': radius}
 
-        response = utils.try_query(service, get_params=params, timeout=self._TIMEOUT, retries=self._RETRIES)
+        response = utils.try_query(service, get_params=params, timeout=self._TIMEOUT, retries=self._RETRIES,
+                                   stream=True, cache=True)
 
         return utils.astropy_table_from_votable_response(response)
 
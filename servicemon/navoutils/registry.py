@@ -7,10 +7,22 @@ from __future__ import print_function, division
 from astroquery.query import BaseQuery
 
 from . import utils
+from .registry_cache import RegistryCache
 
 __all__ = ['Registry', 'RegistryClass']
 
 
+def _result_table(response):
+    # Raises for a failed registry query, rather than returning the empty
+    # table astropy_table_from_votable_response gives for one, so that it
+    # isn't cached as the query's result.
+    response.raise_for_status()
+    table = utils.astropy_table_from_votable_response(response)
+    if len(table.columns) == 0:
+        raise ValueError('The registry response from {} is not a VOTable.'.format(response.url))
+    return table
+
+
 class RegistryClass(BaseQuery):
     """
     Registry query class.
@@ -22,6 +34,24 @@ class RegistryClass(BaseQuery):
         self._TIMEOUT = 60  # seconds
         self._RETRIES = 2  # total number of times to try
         self._REGISTRY_TAP_SYNC_URL = "http://vao.stsci.edu/RegTAP/TapService.aspx/sync"
+        self._cache = None
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def enable_cache(self, directory=None, ttl=24 * 3600., stale_while_revalidate=True, max_stale=7 * 24 * 3600.):
+        """
+        Cache query() and query_counts() results on disk, keyed by their ADQL.
+        See RegistryCache for the meaning of the arguments.
+        """
+        self._cache = RegistryCache(directory=directory, ttl=ttl,
+                                    stale_while_revalidate=stale_while_revalidate,
+                                    max_stale=max_stale)
+        return self._cache
+
+    def disable_cache(self):
+        self._cache = None
 
     def query(self, **kwargs):
 
@@ -29,24 +59,31 @@ class RegistryClass(BaseQuery):
         if adql is None:
             raise ValueError('Unable to compute query based on input arguments.')
 
-        if kwargs.get('verbose'):
-            print('Registry:  sending query ADQL = {}\n'.format(adql))
+        def load():
+            if kwargs.get('verbose'):
+                print('Registry:  sending query ADQL = {}\n'.format(adql))
 
-        url = self._REGISTRY_TAP_SYNC_URL
+            url = self._REGISTRY_TAP_SYNC_URL
 
-        tap_params = {
-            "request": "doQuery",
-            "lang": "ADQL",
-            "query": adql
-        }
+            tap_params = {
+                "request": "doQuery",
+                "lang": "ADQL",
+                "query": adql
+            }
 
-        response = utils.try_query(url, post_data=tap_params, timeout=self._TIMEOUT, retries=self._RETRIES)
+            response = utils.try_query(url, post_data=tap_params, timeout=self._TIMEOUT, retries=self._RETRIES)
 
-        if kwargs.get('verbose'):
-            print('Queried: {}\n'.format(response.url))
+            if kwargs.get('verbose'):
+                print('Queried: {}\n'.format(response.url))
 
-        aptable = utils.astropy_table_from_votable_response(response)
-        return aptable
+            return _result_table(response)
+
+        return self._cached(adql, load)
+
+    def _cached(self, adql, load):
+        if self._cache is None:
+            return load()
+        return self._cache.fetch(adql, load)
 
     # TBD support list of wavebands
     # TBD maybe support raw ADQL clause (or maybe we should just make
@@ -147,25 +184,29 @@ class RegistryClass(BaseQuery):
     def query_counts(self, field, minimum=1, **kwargs):
 
         adql = self._build_counts_adql(field, minimum)
+        if adql is None:
+            raise ValueError('Unable to compute counts query for field {}.'.format(field))
+
+        def load():
+            if kwargs.get('verbose'):
+                print('Registry:  sending query ADQL = {}\n'.format(adql))
 
-        if kwargs.get('verbose'):
-            print('Registry:  sending query ADQL = {}\n'.format(adql))
+            url = self._REGISTRY_TAP_SYNC_URL
 
-        url = self._REGISTRY_TAP_SYNC_URL
+            tap_params = {
+                "request": "doQuery",
+                "lang": "ADQL",
+                "query": adql
+            }
 
-        tap_params = {
-            "request": "doQuery",
-            "lang": "ADQL",
-            "query": adql
-        }
+            response = self._request('POST', url, data=tap_params, cache=False)
 
-        response = self._request('POST', url, data=tap_params, cache=False)
+            if kwargs.get('verbose'):
+                print('Queried: {}\n'.format(response.url))
 
-        if kwargs.get('verbose'):
-            print('Queried: {}\n'.format(response.url))
+            return _result_table(response)
 
-        aptable = utils.astropy_table_from_votable_response(response)
-        return aptable
+        return self._cached(adql, load)
 
     def _build_counts_adql(self, field, minimum=1):
 
@@ -0,0 +1,194 @@
+#
+# Imports
+#
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import pathlib
+import tempfile
+import threading
+import time
+import warnings
+
+from . import utils
+
+__all__ = ['RegistryCache']
+
+
+class RegistryCache():
+    """
+    On-disk cache of registry query results, keyed by the ADQL sent.
+
+    Each result table is stored as a gzipped BINARY2 VOTable with a small JSON
+    sidecar holding the ADQL, the time it was fetched and the source URL.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        Where to keep the cache files.  Defaults to ~/.servicemon/registry_cache.
+    ttl : float
+        Seconds for which a cached result is fresh and is returned without
+        contacting the registry.
+    stale_while_revalidate : bool
+        If True, a result older than ttl (but no older than ttl + max_stale)
+        is returned immediately while a background thread fetches a new one.
+    max_stale : float
+        Seconds past ttl for which a stale result may be served.  Regardless of
+        this, a stale result is returned if fetching a new one fails.
+    """
+
+    def __init__(self, directory=None, ttl=24 * 3600., stale_while_revalidate=True,
+                 max_stale=7 * 24 * 3600.):
+        if directory is None:
+            directory = pathlib.Path.home() / '.servicemon' / 'registry_cache'
+        self._directory = pathlib.Path(directory)
+        self._ttl = ttl
+        self._stale_while_revalidate = stale_while_revalidate
+        self._max_stale = max_stale
+        self._lock = threading.Lock()
+        self._refreshing = set()
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    def fetch(self, adql, loader):
+        """
+        Returns the result table for adql, from the cache when possible.
+
+        Parameters
+        ----------
+        adql : str
+            The query, which is also the cache key.
+        loader : callable
+            Called with no arguments to query the registry when the cache
+            can't be used.  Must return an astropy Table, and raise if the
+            query fails.  A result with no rows is not cached, and is
+            treated as a failure if there is a stale result to fall back on.
+
+        Returns
+        -------
+        astropy.table.Table
+            The result table.  meta['cache_age'] gives the age in seconds of a
+            cached result, and is 0 for a result fetched just now.
+        """
+        table, age = self.get(adql)
+        if table is not None:
+            if age <= self._ttl:
+                return table
+            if self._stale_while_revalidate and age <= self._ttl + self._max_stale:
+                self._refresh_in_background(adql, loader)
+                return table
+
+        try:
+            fresh = loader()
+            if len(fresh) == 0 and table is not None:
+                raise ValueError('the registry returned no rows')
+        except Exception as e:
+            if table is None:
+                raise
+            print("WARNING: registry query failed ({}); using cached result from {:.0f}s ago.".format(e, age))
+            return table
+        self.put(adql, fresh)
+        fresh.meta['cache_age'] = 0
+        return fresh
+
+    def get(self, adql):
+        """
+        Returns (table, age in seconds) for adql, or (None, None) if it isn't
+        cached or the cache entry can't be read.
+        """
+        from astropy.table import Table
+
+        data_path, meta_path = self._paths(adql)
+        try:
+            with open(meta_path) as fd:
+                info = json.load(fd)
+            if info.get('adql') != adql:
+                return (None, None)
+            with open(data_path, 'rb') as fd:
+                content = gzip.decompress(fd.read())
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                table = Table.read(io.BytesIO(content), format='votable')
+        except Exception:
+            return (None, None)
+
+        utils.stringify_table(table)
+        age = time.time() - info['fetched']
+        table.meta['url'] = info.get('url')
+        table.meta['cache_age'] = age
+        return (table, age)
+
+    def put(self, adql, table):
+        """
+        Stores table as the result for adql.  A table with no rows, which is
+        more likely a failed query than a real result, is not stored.
+        """
+        from astropy.table import Table
+
+        if len(table) == 0:
+            return
+        self._directory.mkdir(parents=True, exist_ok=True)
+        data_path, meta_path = self._paths(adql)
+
+        # The raw response text is not worth keeping, and meta values need
+        # not be serializable, so only the columns are written.
+        content = io.BytesIO()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            Table(table, copy=False, meta={}).write(content, format='votable',
+                                                    tabledata_format='binary2')
+        self._write_atomic(data_path, gzip.compress(content.getvalue()))
+
+        info = {'adql': adql, 'fetched': time.time(), 'url': table.meta.get('url')}
+        self._write_atomic(meta_path, json.dumps(info).encode('utf-8'))
+
+    def clear(self):
+        """
+        Removes all cached results.
+        """
+        if self._directory.exists():
+            for path in self._directory.glob('*.vot.gz'):
+                path.unlink()
+            for path in self._directory.glob('*.json'):
+                path.unlink()
+
+    def _paths(self, adql):
+        key = hashlib.sha256(adql.encode('utf-8')).hexdigest()
+        return (self._directory / (key + '.vot.gz'), self._directory / (key + '.json'))
+
+    def _write_atomic(self, path, data):
+        # Write to a temp file and rename it, so readers never see a partial file.
+        fd, tmp_path = tempfile.mkstemp(dir=str(self._directory), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, str(path))
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def _refresh_in_background(self, adql, loader):
+        with self._lock:
+            if adql in self._refreshing:
+                return
+            self._refreshing.add(adql)
+
+        def refresh():
+            try:
+                self.put(adql, loader())
+            except Exception as e:
+                print("WARNING: background registry refresh failed: {}".format(e))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(adql)
+
+        threading.Thread(target=refresh, daemon=True).start()
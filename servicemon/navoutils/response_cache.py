@@ -0,0 +1,340 @@
+#
+# Imports
+#
+
+import collections
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse, urlunparse
+
+__all__ = ['ResponseCache']
+
+# Response headers kept with a cached body.  The body is stored decoded, so
+# Content-Encoding and Content-Length are not among them.
+_KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+class ResponseCache():
+    """
+    Size-bounded on-disk cache of GET responses, for try_query (see
+    utils.enable_response_cache).
+
+    Entries are keyed by the URL plus the normalized query parameters.  The
+    bodies are content-addressed (stored under the SHA-256 of their bytes), so
+    requests with identical results share one file.  When the total size of
+    the bodies exceeds max_bytes, the least recently used entries are evicted.
+
+    A cached response that came with an ETag or Last-Modified header is
+    revalidated with a conditional request (If-None-Match/If-Modified-Since)
+    unless it was validated less than fresh_for seconds ago, and a 304 answer
+    is served from the cache.  One without either header is served without
+    contacting the server until it is max_age seconds old (never expiring if
+    max_age is None).  If the server can't be reached, the cached response is
+    served anyway.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        Where to keep the cache files.  Defaults to ~/.servicemon/response_cache.
+    max_bytes : int
+        Upper limit for the total size of the cached bodies.
+    fresh_for : float
+        Seconds after validation for which a response with validators is
+        served without revalidating it.
+    max_age : float or None
+        Seconds for which a response without validators is served.
+    """
+
+    def __init__(self, directory=None, max_bytes=1024 ** 3, fresh_for=0., max_age=None):
+        if directory is None:
+            directory = pathlib.Path.home() / '.servicemon' / 'response_cache'
+        self._directory = pathlib.Path(directory)
+        self._entries_dir = self._directory / 'entries'
+        self._bodies_dir = self._directory / 'bodies'
+        self._max_bytes = max_bytes
+        self._fresh_for = fresh_for
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._counts = collections.Counter()
+
+        # key -> entry dict, least recently used first; and the number of
+        # entries using each body, whose sizes make up _total_bytes.
+        self._entries = collections.OrderedDict()
+        self._body_refs = collections.Counter()
+        self._body_sizes = {}
+        self._total_bytes = 0
+        self._load_index()
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns a dict of counts: hits (served without contacting the server),
+        revalidated (served after a 304), stale (served because the server
+        couldn't be reached), misses (fetched from the server), stored and
+        evicted, plus the current number of entries and total bytes.
+        """
+        with self._lock:
+            counts = {name: self._counts[name]
+                      for name in ('hits', 'revalidated', 'stale', 'misses', 'stored', 'evicted')}
+            counts['entries'] = len(self._entries)
+            counts['bytes'] = self._total_bytes
+        return counts
+
+    @staticmethod
+    def key(url, params=None):
+        """
+        Returns the cache key for a GET of url with the query params.
+        """
+        parsed = urlparse(url)
+        url = urlunparse(parsed._replace(scheme=parsed.scheme.lower(), netloc=parsed.netloc.lower()))
+        url = url.rstrip('?&')
+        if params is None:
+            params = {}
+        items = params.items() if hasattr(params, 'items') else params
+        normalized = sorted((str(name), str(value)) for name, value in items)
+        return hashlib.sha256(json.dumps(['GET', url, normalized]).encode('utf-8')).hexdigest()
+
+    def fetch(self, url, params, send):
+        """
+        Returns the response for a GET of url with params, from the cache if
+        possible.
+
+        send is called with a dict of extra request headers (or None) to
+        make the request when the cache can't answer by itself; it returns a
+        requests.Response.  Responses served from the cache have a
+        from_cache attribute that is True, and their body is read from the
+        cache file.
+        """
+        key = self.key(url, params)
+        entry = self._lookup(key)
+        if entry is not None and self._is_fresh(entry):
+            response = self._response(key, entry, 'hits')
+            if response is not None:
+                return response
+
+        headers = {}
+        if entry is not None:
+            if entry['headers'].get('ETag'):
+                headers['If-None-Match'] = entry['headers']['ETag']
+            if entry['headers'].get('Last-Modified'):
+                headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+        try:
+            response = send(headers or None)
+        except Exception as e:
+            stale = None if entry is None else self._response(key, entry, 'stale')
+            if stale is None:
+                raise
+            print("WARNING: request to {} failed ({}); using the cached response.".format(url, e))
+            return stale
+
+        if entry is not None and response.status_code == 304:
+            response.close()
+            entry['validated'] = time.time()
+            self._write_entry(key, entry)
+            cached = self._response(key, entry, 'revalidated')
+            if cached is not None:
+                return cached
+            response = send(None)
+
+        with self._lock:
+            self._counts['misses'] += 1
+        if response.status_code != 200 or 'no-store' in response.headers.get('Cache-Control', ''):
+            return response
+        return self._store(key, url, response)
+
+    def clear(self):
+        """
+        Removes all cached responses.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    #
+    # Index
+    #
+
+    def _load_index(self):
+        # Entries are ordered by the modification times of their files, which
+        # are touched on every use.
+        if not self._entries_dir.exists():
+            return
+        found = []
+        for path in self._entries_dir.glob('*.json'):
+            try:
+                with open(path) as fd:
+                    entry = json.load(fd)
+                found.append((path.stat().st_mtime, path.stem, entry))
+            except (OSError, ValueError):
+                continue
+        for _, key, entry in sorted(found, key=lambda f: f[0]):
+            self._add(key, entry)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # Perhaps written by another process.
+                try:
+                    with open(self._entry_path(key)) as fd:
+                        entry = json.load(fd)
+                except (OSError, ValueError):
+                    return None
+                self._add(key, entry)
+            return entry
+
+    def _add(self, key, entry):
+        # Called with the lock held (or before the cache is shared).  The new
+        # body is referenced before the old one is released, in case they
+        # are the same.
+        old = self._entries.pop(key, None)
+        self._entries[key] = entry
+        body = entry['body']
+        if self._body_refs[body] == 0:
+            self._body_sizes[body] = entry['size']
+            self._total_bytes += entry['size']
+        self._body_refs[body] += 1
+        if old is not None:
+            self._release_body(old['body'])
+
+    def _release_body(self, body):
+        self._body_refs[body] -= 1
+        if self._body_refs[body] <= 0:
+            del self._body_refs[body]
+            self._total_bytes -= self._body_sizes.pop(body, 0)
+            try:
+                self._body_path(body).unlink()
+            except OSError:
+                pass
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._release_body(entry['body'])
+        try:
+            self._entry_path(key).unlink()
+        except OSError:
+            pass
+
+    def _evict(self, keep):
+        # Drop least recently used entries (other than keep) until under max_bytes.
+        for key in list(self._entries):
+            if self._total_bytes <= self._max_bytes:
+                break
+            if key != keep:
+                self._remove(key)
+                self._counts['evicted'] += 1
+
+    #
+    # Entries and bodies
+    #
+
+    def _is_fresh(self, entry):
+        headers = entry['headers']
+        if headers.get('ETag') or headers.get('Last-Modified'):
+            return time.time() - entry['validated'] < self._fresh_for
+        return self._max_age is None or time.time() - entry['stored'] < self._max_age
+
+    def _response(self, key, entry, outcome):
+        # Returns a requests.Response whose body is read from the cache file,
+        # or None (dropping the entry) if the body has gone.  outcome names
+        # the counter to increment, if any.
+        import requests
+        from requests.structures import CaseInsensitiveDict
+        from requests.utils import get_encoding_from_headers
+
+        try:
+            raw = open(self._body_path(entry['body']), 'rb')
+        except OSError:
+            with self._lock:
+                self._remove(key)
+            return None
+
+        with self._lock:
+            if outcome is not None:
+                self._counts[outcome] += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        try:
+            os.utime(str(self._entry_path(key)))
+        except OSError:
+            pass
+
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.url = entry['url']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = raw
+        response.from_cache = True
+        return response
+
+    def _store(self, key, url, response):
+        # Streams the body to a temp file while hashing it, then files it
+        # under its hash and serves the response from there.
+        self._entries_dir.mkdir(parents=True, exist_ok=True)
+        self._bodies_dir.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=str(self._bodies_dir), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            body = digest.hexdigest()
+            os.replace(tmp_path, str(self._body_path(body)))
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        finally:
+            response.close()
+
+        now = time.time()
+        entry = {
+            'url': response.url or url,
+            'headers': {name: response.headers[name] for name in _KEPT_HEADERS if name in response.headers},
+            'body': body,
+            'size': size,
+            'stored': now,
+            'validated': now
+        }
+        self._write_entry(key, entry)
+        with self._lock:
+            self._add(key, entry)
+            self._counts['stored'] += 1
+            self._evict(keep=key)
+        return self._response(key, entry, None)
+
+    def _write_entry(self, key, entry):
+        fd, tmp_path = tempfile.mkstemp(dir=str(self._entries_dir), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, str(self._entry_path(key)))
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def _entry_path(self, key):
+        return self._entries_dir / (key + '.json')
+
+    def _body_path(self, body):
+        return self._bodies_dir / (body + '.body')
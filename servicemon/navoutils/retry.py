@@ -0,0 +1,249 @@
+#
+# Imports
+#
+
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+__all__ = ['RetryPolicy', 'RetryBudget', 'CircuitBreaker', 'CircuitBreakers',
+           'CircuitOpenError', 'circuit_breakers', 'default_retry_budget']
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of sending a request to a host whose circuit breaker is open.
+    """
+
+
+#
+# Retry budget
+#
+
+class RetryBudget():
+    """
+    Caps retries at a fraction of requests, shared by all the callers using it.
+
+    Each first attempt deposits ratio tokens (up to max_tokens) and each retry
+    withdraws one, so when many requests are failing at once retries stop
+    adding load instead of multiplying it.  The budget starts with
+    initial_tokens so that retries are possible before any traffic.
+    """
+
+    def __init__(self, ratio=0.2, initial_tokens=10., max_tokens=100.):
+        if ratio < 0:
+            raise ValueError('ratio must not be negative.')
+        self._ratio = ratio
+        self._max_tokens = max_tokens
+        self._tokens = min(initial_tokens, max_tokens)
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self._max_tokens, self._tokens + self._ratio)
+
+    def withdraw(self):
+        """
+        Takes a token for one retry.  Returns False if there is none left.
+        """
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+default_retry_budget = RetryBudget()
+
+
+#
+# Retry policy
+#
+
+class RetryPolicy():
+    """
+    How try_query retries a request.
+
+    Parameters
+    ----------
+    max_attempts : int
+        The total number of attempts, including the first.
+    base_delay : float
+        Seconds before the first retry, before jitter.
+    multiplier : float
+        Factor by which the delay grows with each retry.
+    max_delay : float
+        Upper limit for any one delay, before jitter.
+    jitter : bool
+        If True, each delay is drawn uniformly from [0, delay] ("full jitter")
+        so that clients which failed together don't retry together.
+    deadline : float or None
+        Seconds from the first attempt after which no more attempts are
+        started.  Per-attempt timeouts are shortened so as not to run past it.
+    retry_statuses : collection of int
+        HTTP statuses that are retried like connection errors.  If the last
+        attempt gets one, that response is returned.
+    budget : RetryBudget or None
+        Shared limit on retries; None for no limit.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.5, multiplier=2., max_delay=30.,
+                 jitter=True, deadline=None, retry_statuses=(502, 503, 504),
+                 budget=default_retry_budget):
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be at least 1.')
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_statuses = frozenset(retry_statuses)
+        self.budget = budget
+
+    def delay(self, retry_number):
+        """
+        Returns the seconds to wait before the given retry (1 for the first).
+        """
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (retry_number - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+
+#
+# Circuit breakers
+#
+
+class CircuitBreaker():
+    """
+    Tracks the health of one host and fails fast while it is unhealthy.
+
+    The breaker is 'closed' (requests allowed) until failure_threshold
+    consecutive failures, then 'open' (requests refused) for reset_timeout
+    seconds, then 'half_open': one trial request is allowed, and its success
+    closes the breaker while its failure opens it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    @property
+    def failures(self):
+        return self._failures
+
+    def allow(self):
+        """
+        Returns True if a request may be sent now.  In the half-open state,
+        only the first caller is allowed through until its result is recorded.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_progress:
+                self._trial_in_progress = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_progress or self._failures >= self._failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._trial_in_progress = False
+
+    def reset(self):
+        self.record_success()
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self._reset_timeout:
+            self._state = self.HALF_OPEN
+        return self._state
+
+
+class CircuitBreakers():
+    """
+    One CircuitBreaker per host, created on first use.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def configure(self, failure_threshold=None, reset_timeout=None):
+        """
+        Changes the settings for breakers created from now on.
+        """
+        if failure_threshold is not None:
+            self._failure_threshold = failure_threshold
+        if reset_timeout is not None:
+            self._reset_timeout = reset_timeout
+
+    def for_url(self, url):
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(self._failure_threshold, self._reset_timeout)
+                self._breakers[host] = breaker
+        return breaker
+
+    def state(self, url):
+        """
+        Returns the state ('closed', 'open' or 'half_open') for url's host.
+        """
+        return self.for_url(url).state
+
+    def is_open(self, url):
+        """
+        True if requests to url's host are currently being refused.
+        """
+        return self.state(url) == CircuitBreaker.OPEN
+
+    def states(self):
+        """
+        Returns a dict of host to breaker state for every host seen so far.
+        """
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {host: breaker.state for host, breaker in breakers.items()}
+
+    def reset(self):
+        with self._lock:
+            self._breakers.clear()
+
+
+# Shared by try_query and anything else that wants to know which hosts are down.
+circuit_breakers = CircuitBreakers()
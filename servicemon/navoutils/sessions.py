@@ -0,0 +1,221 @@
+#
+# Imports
+#
+
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+
+__all__ = ['SessionPool', 'session_pool']
+
+#
+# Connection classes that note when a new socket is opened, and how long DNS
+# resolution, the TCP connect and the TLS handshake took.  urllib3 opens
+# connections lazily in the thread making the request, so thread-local state
+# carries this back to SessionPool.request().
+#
+
+_local = threading.local()
+
+
+def _mark_phase(phase, start, end):
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings[phase] = (start, end)
+
+
+class _TimedConnectionMixin():
+    def _new_conn(self):
+        # Resolve the host ourselves so DNS can be timed separately from the
+        # TCP connect, then let urllib3 connect to each resolved address in
+        # turn until one succeeds, as it would if it resolved the host itself.
+        # The original host is still used for the Host header and for TLS.
+        dns_host = self._dns_host
+        start = time.time()
+        try:
+            addrinfo = socket.getaddrinfo(dns_host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except socket.gaierror:
+            addrinfo = []  # Let urllib3 raise its usual error below.
+        resolved = time.time()
+        _mark_phase('dns', start, resolved)
+
+        addresses = list(dict.fromkeys(info[4][0] for info in addrinfo)) or [dns_host]
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    conn = super()._new_conn()
+                    break
+                except (ConnectTimeoutError, NewConnectionError):
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = dns_host
+        _mark_phase('connect', resolved, time.time())
+        return conn
+
+
+class _TrackedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    def connect(self):
+        _local.new_connection = True
+        super().connect()
+
+
+class _TrackedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    def connect(self):
+        _local.new_connection = True
+        super().connect()
+        timings = getattr(_local, 'timings', None)
+        if timings is not None and 'connect' in timings:
+            _mark_phase('tls', timings['connect'][1], time.time())
+
+
+class _TrackedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TrackedHTTPConnection
+
+
+class _TrackedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TrackedHTTPSConnection
+
+
+class _TrackedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TrackedHTTPConnectionPool,
+            'https': _TrackedHTTPSConnectionPool
+        }
+
+#
+# Per-host pool of keep-alive sessions
+#
+
+
+class SessionPool():
+    """
+    Shared keep-alive HTTP sessions, one requests.Session per scheme and host,
+    so that repeated queries to a service reuse their TCP/TLS connections
+    instead of paying DNS, connect and handshake costs on every request.
+
+    Parameters
+    ----------
+    pool_maxsize : int
+        Maximum number of connections kept open to a single host.  This should
+        be at least the number of concurrent requests expected per host.
+    keep_alive : bool
+        If False, every request asks the server to close the connection, which
+        is useful for measuring cold-connection latency.
+    """
+
+    def __init__(self, pool_maxsize=10, keep_alive=True):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._pool_maxsize = pool_maxsize
+        self._keep_alive = keep_alive
+
+    @property
+    def pool_maxsize(self):
+        return self._pool_maxsize
+
+    @property
+    def keep_alive(self):
+        return self._keep_alive
+
+    def configure(self, pool_maxsize=None, keep_alive=None):
+        """
+        Change the pool settings.  Existing sessions are closed, and new ones
+        are created with the new settings as hosts are next queried.
+        """
+        with self._lock:
+            if pool_maxsize is not None:
+                self._pool_maxsize = pool_maxsize
+            if keep_alive is not None:
+                self._keep_alive = keep_alive
+            self._close_sessions()
+
+    def session_for(self, url):
+        """
+        Returns the shared requests.Session for the host of the given URL.
+        """
+        parsed = urlparse(url)
+        key = (parsed.scheme.lower(), parsed.netloc.lower())
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._new_session()
+                self._sessions[key] = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request through the session for the URL's host.
+
+        Parameters
+        ----------
+        method : str
+            HTTP method, e.g. 'GET' or 'POST'.
+        url : str
+            The URL to query.
+        **kwargs
+            Passed through to requests.Session.request().
+
+        Returns
+        -------
+        requests.Response
+            The response, with two extra attributes:  connection_reused is True
+            if the request went over an already open connection, and timings
+            is a dict mapping phase names ('dns', 'connect', 'tls' and 'ttfb')
+            to (start, end) times from time.time().  dns, connect and tls are
+            present only if a new connection was opened (tls only for https).
+            ttfb runs from the end of connection setup (or from the start of
+            the request on a reused connection) until the response headers
+            were received, so with stream=True it excludes the body transfer.
+        """
+        session = self.session_for(url)
+        _local.new_connection = False
+        _local.timings = timings = {}
+        start = time.time()
+        try:
+            response = session.request(method, url, **kwargs)
+        finally:
+            _local.timings = None
+        end = time.time()
+
+        setup_end = max([start] + [phase_end for (_, phase_end) in timings.values()])
+        timings['ttfb'] = (setup_end, end)
+        response.connection_reused = not _local.new_connection
+        response.timings = timings
+        return response
+
+    def close(self):
+        """
+        Closes all the pooled sessions and their connections.
+        """
+        with self._lock:
+            self._close_sessions()
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = _TrackedHTTPAdapter(pool_connections=1, pool_maxsize=self._pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self._keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def _close_sessions(self):
+        for session in self._sessions.values():
+            session.close()
+        self._sessions = {}
+
+
+# The pool shared by servicemon.query and navoutils.utils.try_query.
+session_pool = SessionPool()
@@ -1,6 +1,4 @@
 from astroquery.query import BaseQuery
-from astroquery.utils import parse_coordinates
-from astropy.coordinates import SkyCoord
 from astropy.table import Table, Row
 from enum import Enum
 
@@ -15,7 +13,7 @@ class SpectraClass(BaseQuery):
         self._TIMEOUT = 60  # seconds to timeout
         self._RETRIES = 3  # total number of times to try
 
-    def query(self, service, coords, radius='0.000001', image_format=None, verbose=False):
+    def query(self, service, coords, radius='0.000001', image_format=None, verbose=False, max_workers=1):
         """Basic spectra search query function
 
         Input coords should be either a single string, a single
@@ -30,12 +28,17 @@ class SpectraClass(BaseQuery):
         of an astropy Table. If none is given, the kwargs will be
         passed to a Registry.query() call.
 
+        max_workers = the number of positions to query at once (default 1).
+        Results are in the order of coords either way; a position whose
+        query fails gives an empty table with the exception in
+        meta['error'].
+
         """
 
         if type(service) is str:
             service = {"access_url": service}
 
-        if type(coords) is str or isinstance(coords, SkyCoord):
+        if type(coords) is str or utils.is_skycoord(coords):
             coords = [coords]
         assert type(coords) is list, "ERROR: Give a coordinate object that is a single string, a list/tuple (ra,dec), a SkyCoord, or a list of any of the above."
 #        Tracer()()
@@ -64,7 +67,8 @@ class SpectraClass(BaseQuery):
         # Expand the input parameters to a list of input parameter dictionaries for the call to query_loop.
         params = [{'coords': c, 'radius': inradius[i], 'image_format': image_format} for i, c in enumerate(coords)]
 
-        result_list = utils.query_loop(self._one_image_search, service=service, params=params, verbose=verbose)
+        result_list = utils.query_loop(self._one_image_search, service=service, params=params, verbose=verbose,
+                                       max_workers=max_workers)
         spectra_result_list = []
         for result in result_list:
             spectra_table = SpectraTable(result, copy=False)
@@ -72,13 +76,37 @@ class SpectraClass(BaseQuery):
 
         return spectra_result_list
 
+    def query_services(self, services, coords, radius='0.000001', image_format=None, max_services=16, timeout=None,
+                       verbose=False, max_workers=1):
+        """Basic spectra search of many services at once
+
+        Input services can be an astropy Table returned from
+        Registry.query() (or selected from it), or any list of services
+        or URLs that query() accepts. Up to max_services of them are
+        queried concurrently; the other arguments are as for query().
+
+        Returns a generator of utils.ServiceResult, one per service in the
+        order they finish, whose result is the list of tables query()
+        returns for that service, or whose error is the exception raised.
+
+        timeout = seconds after which a service that hasn't finished is
+        reported with a TimeoutError and no longer waited for, so one slow
+        archive doesn't hold up the rest (default None, no limit).
+
+        """
+        def search(service):
+            return self.query(service, coords, radius=radius, image_format=image_format, verbose=verbose,
+                              max_workers=max_workers)
+
+        return utils.search_services(search, services, max_workers=max_services, timeout=timeout)
+
     def _one_image_search(self, coords, radius, service, image_format=None):
         if (type(coords) is tuple or type(coords) is list) and len(coords) == 2:
-            coords = parse_coordinates("{} {}".format(coords[0], coords[1]))
+            coords = utils.parse_coordinates("{} {}".format(coords[0], coords[1]))
         elif type(coords) is str:
-            coords = parse_coordinates(coords)
+            coords = utils.parse_coordinates(coords)
         else:
-            assert isinstance(coords, SkyCoord), "ERROR: cannot parse input coordinates {}".format(coords)
+            assert utils.is_skycoord(coords), "ERROR: cannot parse input coordinates {}".format(coords)
 
         params = {
             'POS': utils.sval(coords.ra.deg) + ',' + utils.sval(coords.dec.deg),
@@ -87,7 +115,8 @@ class SpectraClass(BaseQuery):
         if image_format is not None:
             params['FORMAT'] = image_format
 
-        response = utils.try_query(service, get_params=params, timeout=self._TIMEOUT, retries=self._RETRIES)
+        response = utils.try_query(service, get_params=params, timeout=self._TIMEOUT, retries=self._RETRIES,
+                                   stream=True, cache=True)
         return utils.astropy_table_from_votable_response(response)
 
     def get_column(self, table, mnemonic):
@@ -97,7 +126,7 @@ class SpectraClass(BaseQuery):
         elif not isinstance(table, Table):
             raise ValueError('table must be an instance of astropy.Table.')
         else:
-            col = utils.find_column_by_utype(table, mnemonic.value)
+            col = utils.find_column_by_utype(table, mnemonic.value['utype'])
         return col
 
     def get_column_name(self, table, mnemonic):
@@ -153,11 +182,9 @@ class SpRow(Row):
     """
     def __getitem__(self, item):
         if isinstance(item, SpectraColumn):
-            colname = self.table.stdcol_to_colname(item)
-            val = None
-            if colname is not None:
-                val = super().__getitem__(colname)
-            return val
+            # Go straight to the column rather than through its name.
+            col = self.table._stdcol_map().column(item)
+            return None if col is None else col[self.index]
         else:
             return super().__getitem__(item)
 
@@ -169,31 +196,13 @@ class SpectraTable(Table):
 
     Row = SpRow
 
-    __utypemap__ = None
-
-    def __compute_utype_column__(self, mnemonic):
-        col = None
-        if not isinstance(mnemonic, SpectraColumn):
-            raise ValueError('mnemonic must be an enumeration member of SpectraColumn.')
-        else:
-            col = utils.find_column_by_utype(self, mnemonic.value['utype'])
-        return col
-
-    def __compute_utype_column_name__(self, mnemonic):
-        name = None
-        col = self.__compute_utype_column__(mnemonic)
-        if col is not None:
-            name = col.name
-        return name
+    def _stdcol_map(self):
+        # Built once per table (and again only if its columns change).
+        return utils.standard_column_map(self, SpectraColumn, 'utype')
 
     def get_utypemap(self):
-        if not self.__utypemap__:
-            self.__utypemap__ = {}
-            for utype in SpectraColumn:
-                colname = self.__compute_utype_column_name__(utype)
-                self.__utypemap__[utype.name] = colname
-
-        return self.__utypemap__
+        stdcols = self._stdcol_map()
+        return {mnemonic.name: stdcols.colname(mnemonic) for mnemonic in SpectraColumn}
 
     def __getitem__(self, item):
         if isinstance(item, SpectraColumn):
@@ -205,24 +214,46 @@ class SpectraTable(Table):
         else:
             return super().__getitem__(item)
 
+    def stdcols(self, *mnemonics):
+        """
+        Returns whole standard columns at once, as a named tuple with one
+        field per given SpectraColumn member (by default, all of them), e.g.
+
+            urls, sizes = table.stdcols(SpectraColumn.ACCESS_URL, SpectraColumn.SIZE)
+
+        Each field is the matching Column, or None if the table has no
+        column with that utype.
+        """
+        return self._stdcol_map().columns(self._check_mnemonics(mnemonics))
+
+    def iter_stdrows(self, *mnemonics):
+        """
+        Fast iteration over the standard columns of every row.  Yields one
+        named tuple per row, with one field per given SpectraColumn member (by
+        default, all of them), e.g.
+
+            for r in table.iter_stdrows(SpectraColumn.ACCESS_URL, SpectraColumn.FORMAT):
+                print(r.ACCESS_URL, r.FORMAT)
+
+        The column lookups are done once for the whole table, not once per
+        cell as when indexing each row.
+        """
+        return self._stdcol_map().rows(self._check_mnemonics(mnemonics), len(self))
+
+    def _check_mnemonics(self, mnemonics):
+        if not mnemonics:
+            return tuple(SpectraColumn)
+        for mnemonic in mnemonics:
+            if not isinstance(mnemonic, SpectraColumn):
+                raise ValueError('mnemonic must be an enumeration member of SpectraColumn.')
+        return mnemonics
+
     def stdcol_to_colname(self, mnemonic):
         if not isinstance(mnemonic, SpectraColumn):
             raise ValueError('mnemonic must be an enumeration member of SpectraColumn.')
-        else:
-            utypemap = self.get_utypemap()
-            name = utypemap.get(mnemonic.name)
-        return name
+        return self._stdcol_map().colname(mnemonic)
 
     def colname_to_stdcol(self, colname):
-        imgcol = None
-        if colname not in self.colnames:
+        if colname not in self.columns:
             raise ValueError(f'colname {colname} is not the name of a column in this table.')
-        else:
-            utypemap = self.get_utypemap()
-            for img, col in utypemap.items():
-                if colname == col:
-                    for e in SpectraColumn:
-                        if e.name == img:
-                            imgcol = e
-
-        return imgcol
+        return self._stdcol_map().member(self.columns[colname])
@@ -4,11 +4,184 @@ VO Queries
 """
 
 from __future__ import print_function, division
+import heapq
+import io
+import time
+import xml.etree.ElementTree as ElementTree
 from astroquery.query import BaseQuery
 import numpy
 from . import utils
 
-__all__ = ['Tap', 'TapClass']
+__all__ = ['Tap', 'TapClass', 'TapJob', 'TapJobError', 'cone_upload_table']
+
+
+class TapJobError(Exception):
+    """
+    Raised when an async TAP job ends without a result, or doesn't end in time.
+    """
+
+    def __init__(self, job, phase, message):
+        super(TapJobError, self).__init__("TAP job {} {}: {}".format(job.url, phase, message))
+        self.job = job
+        self.phase = phase
+
+
+class TapJob():
+    """
+    One async (UWS) TAP job, as returned by TapClass.submit_job().
+    """
+
+    # Phases after which a job won't change by itself.
+    FINAL_PHASES = ('COMPLETED', 'ERROR', 'ABORTED', 'ARCHIVED')
+
+    def __init__(self, url, timeout=60, retries=2):
+        self.url = url.rstrip('/')
+        self._timeout = timeout
+        self._retries = retries
+
+    def __repr__(self):
+        return "TapJob({!r})".format(self.url)
+
+    def phase(self):
+        """
+        Returns the job's current phase, e.g. 'EXECUTING' or 'COMPLETED'.
+        """
+        response = utils.try_query(self.url + '/phase', get_params={}, timeout=self._timeout,
+                                   retries=self._retries, cache=False)
+        response.raise_for_status()
+        return response.text.strip().upper()
+
+    def run(self):
+        """
+        Starts a job that was submitted without starting it (phase PENDING).
+        """
+        response = utils.try_query(self.url + '/phase', post_data={'PHASE': 'RUN'},
+                                   timeout=self._timeout, retries=self._retries)
+        response.raise_for_status()
+
+    def wait(self, timeout=None, poll_interval=0.5, max_poll_interval=30., backoff=1.5):
+        """
+        Polls the job's phase until it is final, and returns that phase.
+
+        The time between polls starts at poll_interval and grows by a factor
+        of backoff up to max_poll_interval, so short jobs finish promptly and
+        long ones aren't polled needlessly often.  TapJobError is raised if
+        the job hasn't finished after timeout seconds (if not None).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            phase = self.phase()
+            if phase in self.FINAL_PHASES:
+                return phase
+            if phase == 'PENDING':
+                self.run()
+            if deadline is not None and time.monotonic() + poll_interval > deadline:
+                raise TapJobError(self, phase, "not finished after {}s".format(timeout))
+            time.sleep(poll_interval)
+            poll_interval = min(max_poll_interval, poll_interval * backoff)
+
+    def error_summary(self):
+        """
+        Returns the job's error document as text ('' if there is none).
+        """
+        response = utils.try_query(self.url + '/error', get_params={}, timeout=self._timeout,
+                                   retries=self._retries, cache=False)
+        return response.text if response.ok else ''
+
+    def fetch(self, path=None, chunk_size=1024 * 1024):
+        """
+        Downloads the result of a completed job.
+
+        The result is streamed, so it is never held in memory as a whole: with
+        path given, it is written to that file, and path is returned;
+        otherwise it is parsed as it is read and the astropy Table returned.
+        """
+        response = utils.try_query(self.url + '/results/result', get_params={}, timeout=self._timeout,
+                                   retries=self._retries, stream=True, cache=False)
+        if not response.ok:
+            response.close()
+            raise TapJobError(self, 'COMPLETED', "result download failed with HTTP status {}".format(
+                response.status_code))
+        if path is None:
+            return utils.astropy_table_from_votable_response(response)
+
+        try:
+            with open(path, 'wb') as fd:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    fd.write(chunk)
+        finally:
+            response.close()
+        return path
+
+    def result(self, path=None, timeout=None, **wait_kwargs):
+        """
+        Waits for the job to finish, then fetches its result (see fetch()).
+        Raises TapJobError if the job ends without one.
+        """
+        phase = self.wait(timeout=timeout, **wait_kwargs)
+        if phase != 'COMPLETED':
+            raise TapJobError(self, phase, self.error_summary().strip() or "no result")
+        return self.fetch(path=path)
+
+    def delete(self):
+        """
+        Asks the service to delete the job and its result.
+        """
+        utils.try_query(self.url, post_data={'ACTION': 'DELETE'}, timeout=self._timeout,
+                        retries=self._retries)
+
+
+def _upload_files(upload):
+    # Returns the multipart files entry for a TAP upload.  The content is
+    # built up front, as bytes rather than an open file, so that the request
+    # can be resent by a retry and no file handle is left open.
+    if isinstance(upload, (str, bytes)) or hasattr(upload, '__fspath__'):
+        with open(upload, 'rb') as fd:
+            content = fd.read()
+    else:
+        from astropy.table import Table
+
+        if not isinstance(upload, Table):
+            upload = Table(upload)
+        buffer = io.BytesIO()
+        # Only the columns are sent; meta values need not be serializable.
+        Table(upload, copy=False, meta={}).write(buffer, format='votable', tabledata_format='binary')
+        content = buffer.getvalue()
+    return {'uplt': ('upload.xml', content, 'application/x-votable+xml')}
+
+
+def cone_upload_table(positions, radius=None):
+    """
+    Returns an astropy Table of cones to upload for batch_cone_search(), with
+    columns pos_id (the index of each cone), ra, dec and radius (in degrees).
+
+    positions may be a SkyCoord, or an (N, 2) or (N, 3) array-like of
+    (ra, dec) or (ra, dec, radius) in degrees.  radius, which may be a single
+    value or one per position, is required unless the radii are in positions.
+    """
+    from astropy.table import Table
+
+    if utils.is_skycoord(positions):
+        ra = numpy.atleast_1d(positions.ra.deg)
+        dec = numpy.atleast_1d(positions.dec.deg)
+        radii = None
+    else:
+        positions = numpy.asarray(positions, dtype=float)
+        positions = positions.reshape(-1, positions.shape[-1])
+        if positions.shape[1] not in (2, 3):
+            raise ValueError('positions must be (ra, dec) or (ra, dec, radius) values.')
+        ra = positions[:, 0]
+        dec = positions[:, 1]
+        radii = positions[:, 2] if positions.shape[1] == 3 else None
+    if radius is not None:
+        radii = numpy.broadcast_to(numpy.asarray(radius, dtype=float), ra.shape)
+    if radii is None:
+        raise ValueError('Give a radius, or positions that include radii.')
+
+    table = Table([numpy.arange(len(ra)), ra, dec, radii], names=('pos_id', 'ra', 'dec', 'radius'))
+    for name in ('ra', 'dec', 'radius'):
+        table[name].unit = 'deg'
+    return table
 
 
 class TapClass(BaseQuery):
@@ -22,7 +195,35 @@ class TapClass(BaseQuery):
         self._TIMEOUT = 60  # seconds
         self._RETRIES = 2  # total number of times to try
 
-    def query(self, service, query, upload_file=None, upload_name=None):
+    def query(self, service, query, upload_file=None, upload_name=None, mode='sync', path=None,
+              job_timeout=None):
+        """
+        Runs the ADQL query on the TAP service.
+
+        With mode='sync' (the default) the query is run by /sync, within a
+        single request of at most _TIMEOUT seconds.  With mode='async' it is
+        submitted to /async as a UWS job, which is polled until it finishes
+        (or job_timeout seconds pass), and its result is streamed: to the
+        file path, which is returned, if given, or else into the VOTable
+        parser.  The job is then deleted from the service.  Use submit_job()
+        to manage a job directly.
+
+        upload_file may be the path of a VOTable file, an astropy Table, or a
+        numpy structured array, which is sent as the table TAP_UPLOAD.<upload_name>.
+        """
+        if mode == 'async':
+            job = self.submit_job(service, query, upload_file=upload_file, upload_name=upload_name)
+            if job is None:
+                return None
+            try:
+                return job.result(path=path, timeout=job_timeout)
+            finally:
+                try:
+                    job.delete()
+                except Exception as e:
+                    print("WARNING: could not delete TAP job {}: {}".format(job.url, e))
+        elif mode != 'sync':
+            raise ValueError("mode must be 'sync' or 'async'.")
 
         if type(service) is str:
             service = {"access_url": service}
@@ -39,8 +240,7 @@ class TapClass(BaseQuery):
             if upload_name is None:
                 print("ERROR: you have to give a name to use in the query for the uploaded table.")
                 return None
-            ## Why does neither of these work?
-            files = {'uplt': open(upload_file, 'rb')}
+            files = _upload_files(upload_file)
             tap_params['upload'] = upload_name+',param:uplt'
         else:
             files = None
@@ -50,5 +250,140 @@ class TapClass(BaseQuery):
         aptable = utils.astropy_table_from_votable_response(response)
         return aptable
 
+    def submit_job(self, service, query, upload_file=None, upload_name=None, run=True):
+        """
+        Submits the ADQL query to the service's /async endpoint and returns
+        its TapJob, started unless run is False.  Submitting returns as soon
+        as the service has created the job, so many jobs can be submitted
+        without waiting for any of them.
+        """
+        if type(service) is str:
+            service = {"access_url": service}
+
+        url = service['access_url'].rstrip('/?') + '/async'
+
+        tap_params = {
+            "request": "doQuery",
+            "lang": "ADQL",
+            "query": query
+        }
+        if run:
+            tap_params['PHASE'] = 'RUN'
+
+        if upload_file is not None:
+            if upload_name is None:
+                print("ERROR: you have to give a name to use in the query for the uploaded table.")
+                return None
+            files = _upload_files(upload_file)
+            tap_params['upload'] = upload_name+',param:uplt'
+        else:
+            files = None
+
+        response = utils.try_query(url, post_data=tap_params, timeout=self._TIMEOUT, retries=self._RETRIES,
+                                   files=files)
+        response.raise_for_status()
+        return TapJob(self._job_url(url, response), timeout=self._TIMEOUT, retries=self._RETRIES)
+
+    def _job_url(self, async_url, response):
+        # The service redirects (303) to the new job, which requests follows,
+        # so the final URL is the job's.  Some services instead answer the
+        # POST with the job document, which gives the job's id.
+        if response.history:
+            return response.url
+        try:
+            root = ElementTree.fromstring(response.content)
+        except ElementTree.ParseError:
+            raise ValueError("Cannot find the job created at {}".format(async_url))
+        for element in root.iter():
+            if element.tag == 'jobId' or element.tag.endswith('}jobId'):
+                return async_url + '/' + element.text.strip()
+        raise ValueError("Cannot find the job created at {}".format(async_url))
+
+    def batch_cone_search(self, service, table_name, positions, radius=None, ra_column='ra',
+                          dec_column='dec', columns='t.*', upload_name='cones', **query_kwargs):
+        """
+        Searches table_name on the TAP service around many positions with a
+        single ADQL query, rather than one cone search request per position.
+
+        The cones (see cone_upload_table() for the forms positions and radius
+        may take) are uploaded as TAP_UPLOAD.<upload_name> and crossmatched
+        with table_name, whose positions are in ra_column and dec_column.
+        The result has a pos_id column giving the index of the matching cone,
+        then the given columns of table_name (by default, all of them).
+        query_kwargs are passed to query(), e.g. mode='async' for big batches.
+        """
+        cones = cone_upload_table(positions, radius=radius)
+        adql = ("SELECT up.pos_id, {columns} FROM {table} AS t "
+                "JOIN TAP_UPLOAD.{upload} AS up "
+                "ON 1=CONTAINS(POINT('ICRS', t.{ra}, t.{dec}), CIRCLE('ICRS', up.ra, up.dec, up.radius))"
+                ).format(columns=columns, table=table_name, upload=upload_name, ra=ra_column, dec=dec_column)
+        return self.query(service, adql, upload_file=cones, upload_name=upload_name, **query_kwargs)
+
+    def query_many(self, service, queries, max_active=8, job_timeout=None, poll_interval=0.5,
+                   max_poll_interval=30., backoff=1.5, delete=True):
+        """
+        Runs many ADQL queries as async jobs on one service and returns their
+        result tables in the order of queries.
+
+        Up to max_active jobs are kept running on the service at once.  They
+        are all polled from the calling thread, each with its own backoff,
+        so no thread waits on any one job.  A query whose job fails or takes
+        longer than job_timeout gives an empty Table whose meta['error'] holds
+        the TapJobError.  Finished jobs are deleted from the service unless
+        delete is False.
+        """
+        from astropy.table import Table
+
+        queries = list(queries)
+        results = [None] * len(queries)
+        next_index = 0
+        # Heap of (next poll time, query index, job, interval, deadline).
+        polls = []
+
+        def finish(i, job, result):
+            results[i] = result
+            if delete:
+                try:
+                    job.delete()
+                except Exception as e:
+                    print("WARNING: could not delete TAP job {}: {}".format(job.url, e))
+
+        while next_index < len(queries) or polls:
+            while next_index < len(queries) and len(polls) < max_active:
+                i = next_index
+                next_index += 1
+                try:
+                    job = self.submit_job(service, queries[i])
+                except Exception as e:
+                    print("ERROR submitting TAP query {}: {}".format(i, e))
+                    results[i] = Table(meta={'error': e})
+                    continue
+                now = time.monotonic()
+                deadline = None if job_timeout is None else now + job_timeout
+                heapq.heappush(polls, (now + poll_interval, i, job, poll_interval, deadline))
+            if not polls:
+                continue
+
+            due, i, job, interval, deadline = heapq.heappop(polls)
+            time.sleep(max(0, due - time.monotonic()))
+            try:
+                phase = job.phase()
+                if phase == 'COMPLETED':
+                    finish(i, job, job.fetch())
+                elif phase in TapJob.FINAL_PHASES:
+                    raise TapJobError(job, phase, job.error_summary().strip() or "no result")
+                elif deadline is not None and time.monotonic() >= deadline:
+                    raise TapJobError(job, phase, "not finished after {}s".format(job_timeout))
+                else:
+                    if phase == 'PENDING':
+                        job.run()
+                    interval = min(max_poll_interval, interval * backoff)
+                    heapq.heappush(polls, (time.monotonic() + interval, i, job, interval, deadline))
+            except Exception as e:
+                print("ERROR running TAP query {}: {}".format(i, e))
+                finish(i, job, Table(meta={'url': job.url, 'error': e}))
+
+        return results
+
 
 Tap = TapClass()
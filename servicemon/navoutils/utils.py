@@ -2,30 +2,93 @@
 # Imports
 #
 
+import collections
+import functools
 import html  # to unescape, which shouldn't be neccessary but currently is
 import io
+import itertools
+import sys
+import tempfile
+import time
 import numpy as np
-from astropy.table import Table
+
+# astropy.table, astropy.coordinates and astroquery are imported where they
+# are used, so that importing navoutils (e.g., for try_query) stays cheap.
+
+from .retry import RetryPolicy, CircuitOpenError, circuit_breakers
+from .sessions import session_pool
 
 #
 # Support for VOTABLEs as astropy tables
 #
 
 
-def astropy_table_from_votable_response(response):
+class LazyResponseText():
+    """
+    Stands in for the text of a response, kept as a reference to the bytes
+    already held for parsing (in memory or in a spooled temp file), and only
+    decoded when str() or read() is called.
+    """
+
+    def __init__(self, fileobj, encoding):
+        self._fileobj = fileobj
+        self._encoding = encoding
+
+    def read(self):
+        self._fileobj.seek(0)
+        return self._fileobj.read().decode(self._encoding, errors='replace')
+
+    def __str__(self):
+        return self.read()
+
+    def __repr__(self):
+        return '<LazyResponseText encoding={}>'.format(self._encoding)
+
+
+def _spool_response(response, spool_size):
+    # Copy the body of a streamed response into memory, switching to an
+    # anonymous temp file once it grows past spool_size bytes.  (This is
+    # done by hand because SpooledTemporaryFile lacks some of the file
+    # methods the astropy reader may call.)
+    spool = io.BytesIO()
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        if isinstance(spool, io.BytesIO) and spool.tell() + len(chunk) > spool_size:
+            on_disk = tempfile.TemporaryFile()
+            on_disk.write(spool.getbuffer())
+            spool = on_disk
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def astropy_table_from_votable_response(response, text=None, spool_size=8 * 1024 * 1024):
     """
     Takes a VOTABLE response from a web service and returns an astropy table.
 
     Parameters
     ----------
     response : requests.Response
-        Response whose contents are assumed to be a VOTABLE.
+        Response whose contents are assumed to be a VOTABLE.  If it was
+        requested with stream=True and not yet read, the body is copied in
+        chunks to a temp file that is only held in memory up to spool_size
+        bytes, so the raw bytes never need to be in memory all at once.
+    text : {'lazy', 'copy', None}
+        What to put in meta['text']:  None (the default) stores nothing, and
+        the raw content is released after parsing; 'copy' stores the decoded
+        text as a str, as response.text would; 'lazy' stores a
+        LazyResponseText, which decodes the raw content only when asked for
+        but keeps it (in memory or an open temp file) as long as the table's
+        meta lives, and which is not a str.
+    spool_size : int
+        Bytes of a streamed response to hold in memory before spilling to disk.
 
     Returns
     -------
     astropy.table.Table
         Astropy Table containing the data from the first TABLE in the VOTABLE.
     """
+    if text not in ('lazy', 'copy', None):
+        raise ValueError("text must be one of 'lazy', 'copy' or None.")
 
     # The astropy table reader would like a file-like object, so convert
     # the response content a byte stream.  This assumes Python 3.x.
@@ -34,14 +97,24 @@ def astropy_table_from_votable_response(response):
     # problems:  It looks for newlines to see if the string is itself a table,
     # and we need to support unicode content.)
     try:
-        file_like_content = io.BytesIO(response.content)
+        if getattr(response, 'from_cache', False) and getattr(response, '_content', None) is False:
+            # Served by the response cache: the body is already a file on
+            # disk, so it is parsed in place rather than copied.
+            file_like_content = response.raw
+        elif getattr(response, '_content', None) is False:
+            # Not read yet (stream=True).
+            file_like_content = _spool_response(response, spool_size)
+        else:
+            file_like_content = io.BytesIO(response.content)
     except IOError:
-        print("ERROR parsing response content? Got:\n    {}...".format(response.content[0:400]))
+        print("ERROR reading response content from {}".format(response.url))
         #  Should this return or raise?
         raise
     except Exception as e:
         raise e
 
+    from astropy.table import Table
+
     # The astropy table reader will auto-detect that the content is a VOTABLE
     # and parse it appropriately.
     try:
@@ -51,7 +124,13 @@ def astropy_table_from_votable_response(response):
         aptable = Table()
 
     aptable.meta['url'] = response.url
-    aptable.meta['text'] = response.text
+    encoding = response.encoding or 'utf-8'
+    if text == 'lazy':
+        aptable.meta['text'] = LazyResponseText(file_like_content, encoding)
+    else:
+        if text == 'copy':
+            aptable.meta['text'] = LazyResponseText(file_like_content, encoding).read()
+        file_like_content.close()
     # String values in the VOTABLE are stored in the astropy Table as bytes instead
     # of strings.  To makes accessing them more convenient, we will convert all those
     # bytes values to strings.
@@ -60,6 +139,249 @@ def astropy_table_from_votable_response(response):
     return aptable
 
 
+#
+# Coordinates
+#
+
+
+def is_skycoord(obj):
+    """
+    Returns True if obj is an astropy SkyCoord, without importing
+    astropy.coordinates (no SkyCoord can exist until it has been imported).
+    """
+    coordinates = sys.modules.get('astropy.coordinates')
+    return coordinates is not None and isinstance(obj, coordinates.SkyCoord)
+
+
+def parse_coordinates(coords):
+    """
+    astroquery.utils.parse_coordinates, imported on first use.
+    """
+    from astroquery.utils import parse_coordinates
+    return parse_coordinates(coords)
+
+
+#
+# Lookup of columns by UCD and utype
+#
+
+
+class ColumnIndex():
+    """
+    Index from UCD and utype values to the columns of a table that carry them,
+    so that repeated lookups don't scan every column's metadata.
+
+    Use column_index(table) rather than creating one directly; it keeps one
+    index per table and rebuilds it when columns are added, removed or
+    replaced.
+    """
+
+    def __init__(self, table):
+        self.generation = 0
+        self._build(table.columns)
+
+    def _build(self, columns):
+        # The columns mapping and the columns themselves are kept referenced,
+        # so their ids can't be reused by other objects while this index
+        # lives.
+        self._columns = columns
+        self._members = tuple(columns.values())
+        self._ids = tuple(map(id, self._members))
+        self.generation += 1
+        self._by_ucd = {}
+        self._by_utype = {}
+        for col in self._members:
+            ucd = col.meta.get('ucd')
+            if ucd is not None:
+                self._by_ucd.setdefault(ucd, []).append(col)
+            utype = col.meta.get('utype')
+            if utype is not None:
+                self._by_utype.setdefault(utype, []).append(col)
+
+    def is_current(self, table):
+        # A constant-time check for a new columns mapping or a different
+        # number of columns.  Columns swapped for others without changing
+        # the count are caught by lookups (see _lookup).
+        return table.columns is self._columns and len(self._columns) == len(self._ids)
+
+    def holds(self, col):
+        """
+        Returns whether col is still the table's column of that name.
+        """
+        return self._columns.get(col.name) is col
+
+    def refresh(self):
+        """
+        Rebuilds the index if the table's columns are no longer the ones it
+        was built from.  Returns whether it was rebuilt.
+        """
+        if tuple(map(id, self._columns.values())) == self._ids:
+            return False
+        self._build(self._columns)
+        return True
+
+    def _lookup(self, attr, key):
+        # A hit is checked against the table's current columns.  A miss may
+        # be a column added or replaced since the index was built, so the
+        # column ids are compared before reporting it.
+        cols = getattr(self, attr).get(key, ())
+        if cols and not all(map(self.holds, cols)):
+            self._build(self._columns)
+            cols = getattr(self, attr).get(key, ())
+        elif not cols and self.refresh():
+            cols = getattr(self, attr).get(key, ())
+        return cols
+
+    def columns_by_ucd(self, ucd):
+        return list(self._lookup('_by_ucd', ucd))
+
+    def columns_by_utype(self, utype):
+        return list(self._lookup('_by_utype', utype))
+
+    def column_by_ucd(self, ucd):
+        cols = self._lookup('_by_ucd', ucd)
+        return cols[0] if cols else None
+
+    def column_by_utype(self, utype):
+        cols = self._lookup('_by_utype', utype)
+        return cols[0] if cols else None
+
+
+def column_index(table):
+    """
+    Returns the ColumnIndex for the given table, building it if the table has
+    none yet or if its columns have changed since it was built.
+
+    Parameters
+    ----------
+    table : astropy.table.Table
+        Astropy Table which was created from a VOTABLE (as if by astropy_table_from_votable_response).
+
+    Returns
+    -------
+    ColumnIndex
+        Index of the table's columns by UCD and utype.
+    """
+    index = getattr(table, '_navo_column_index', None)
+    if index is None or not index.is_current(table):
+        index = ColumnIndex(table)
+        table._navo_column_index = index
+    return index
+
+
+class StandardColumnMap():
+    """
+    Two-way map between the members of a standard column enumeration (such as
+    ImageColumn) and the columns of one table, matched by the UCD or utype
+    given in each member's value.
+
+    Use standard_column_map(table, enum, key) rather than creating one
+    directly; it keeps the map with the table and rebuilds it along with the
+    table's ColumnIndex.  Columns are held rather than names, so renaming a
+    column doesn't make the map stale.
+    """
+
+    def __init__(self, index, enum, key):
+        self.index = index
+        self._by_member = {}
+        self._by_column = {}
+        if key == 'ucd':
+            find = index.column_by_ucd
+        elif key == 'utype':
+            find = index.column_by_utype
+        else:
+            raise ValueError(f'key must be "ucd" or "utype", not {key}.')
+        self._num_members = 0
+        for member in enum:
+            self._num_members += 1
+            col = find(member.value[key])
+            if col is not None:
+                self._by_member[member] = col
+                self._by_column.setdefault(id(col), member)
+        self._generation = index.generation
+
+    def column(self, member):
+        return self._by_member.get(member)
+
+    def colname(self, member):
+        col = self._by_member.get(member)
+        return None if col is None else col.name
+
+    def member(self, column):
+        return self._by_column.get(id(column))
+
+    def columns(self, mnemonics):
+        """
+        Returns a named tuple, with one field per mnemonic (named after the
+        member), of the matching whole Columns, or None where the table has
+        no such column.
+        """
+        mnemonics = tuple(mnemonics)
+        return _stdcol_tuple(mnemonics)._make(self._by_member.get(m) for m in mnemonics)
+
+    def rows(self, mnemonics, num_rows):
+        """
+        Yields one named tuple per row, with one field per mnemonic as for
+        columns().  Values are plain Python objects (None where masked or
+        where the table has no such column).
+        """
+        mnemonics = tuple(mnemonics)
+        make = _stdcol_tuple(mnemonics)._make
+        # tolist() converts each whole column in one step rather than a cell at a time.
+        values = [itertools.repeat(None, num_rows) if col is None else col.tolist()
+                  for col in (self._by_member.get(m) for m in mnemonics)]
+        return map(make, zip(*values))
+
+    def is_current(self, index):
+        # The mapped columns are checked for any replaced in place, and if
+        # some members are unmatched, the index for columns added since.
+        if index is not self.index or index.generation != self._generation:
+            return False
+        if not all(map(index.holds, self._by_member.values())):
+            return False
+        if len(self._by_member) < self._num_members:
+            index.refresh()
+        return index.generation == self._generation
+
+
+@functools.lru_cache(maxsize=None)
+def _stdcol_tuple(mnemonics):
+    # One named tuple type per distinct selection of standard columns.
+    return collections.namedtuple('StandardColumns', [m.name for m in mnemonics])
+
+
+def standard_column_map(table, enum, key):
+    """
+    Returns the StandardColumnMap from the members of enum to the columns of
+    table, building it if the table has none yet or if its columns have changed
+    since it was built.
+
+    Parameters
+    ----------
+    table : astropy.table.Table
+        Astropy Table which was created from a VOTABLE (as if by astropy_table_from_votable_response).
+    enum : Enum class
+        The standard columns, each with a dict value holding the key below.
+    key : str
+        'ucd' or 'utype', the metadata by which columns are matched.
+
+    Returns
+    -------
+    StandardColumnMap
+        Map between the enum's members and the table's columns.
+    """
+    index = column_index(table)
+    maps = getattr(table, '_navo_stdcol_maps', None)
+    if maps is None:
+        maps = {}
+        table._navo_stdcol_maps = maps
+    stdcols = maps.get((enum, key))
+    if stdcols is None or not stdcols.is_current(index):
+        stdcols = StandardColumnMap(index, enum, key)
+        maps[(enum, key)] = stdcols
+    return stdcols
+
+
 def find_column_by_ucd(table, ucd):
     """
     Given an astropy table derived from a VOTABLE, this function returns
@@ -84,16 +406,15 @@ def find_column_by_ucd(table, ucd):
     col = find_column_by_ucd(my_table, 'VOX:Image_Title')
     print ('1st row title value is:', my_table[col.name][0])
     """
+    return column_index(table).column_by_ucd(ucd)
 
-    # Loop through all the columns looking for the UCD
-    for key in table.columns:
-        col = table.columns[key]
-        ucdval = col.meta.get('ucd')
-        if ucdval is not None:
-            if ucd == ucdval:
-                return col
 
-    return None
+def find_columns_by_ucd(table, ucd):
+    """
+    Like find_column_by_ucd(), but returns a list of all the columns that have
+    the given UCD, in table order (empty if there are none).
+    """
+    return column_index(table).columns_by_ucd(ucd)
 
 
 def find_column_by_utype(table, utype):
@@ -120,16 +441,15 @@ def find_column_by_utype(table, utype):
     col = find_column_by_utype(my_table, 'Access.Reference')
     print ('1st row access_url value is:', my_table[col.name][0])
     """
+    return column_index(table).column_by_utype(utype)
 
-    # Loop through all the columns looking for the utype
-    for key in table.columns:
-        col = table.columns[key]
-        utypeval = col.meta.get('utype')
-        if utypeval is not None:
-            if utype == utypeval:
-                return col
 
-    return None
+def find_columns_by_utype(table, utype):
+    """
+    Like find_column_by_utype(), but returns a list of all the columns that
+    have the given utype, in table order (empty if there are none).
+    """
+    return column_index(table).columns_by_utype(utype)
 
 #
 # Functions to help replace bytes with strings in astropy tables that came from VOTABLEs
@@ -161,10 +481,50 @@ def sval(val):
 svalv = np.vectorize(sval)
 
 
+def _decode_values(values):
+    """
+    Returns a list of the string versions of the given values, as if by sval().
+    When the values are all bytes they are joined, decoded and split in single
+    calls rather than decoded one by one.
+    """
+    try:
+        decoded = b'\x00'.join(values).decode('utf-8').split('\x00')
+        if len(decoded) == len(values):
+            return decoded
+        # Some value contained a NUL itself, so the split was ambiguous.
+    except (TypeError, UnicodeDecodeError):
+        # Mixed (or undecodable) values; sval() handles or reports each one.
+        pass
+    return [sval(v) for v in values]
+
+
+def _decode_array(data):
+    """
+    Returns a str array of the values in data, an array of bytes objects,
+    decoded as utf-8 in whole-array steps, or None if the values can't be
+    converted that way (e.g., non-ASCII str or array values).  Trailing NUL
+    bytes are dropped, as for any numpy bytes array.
+    """
+    try:
+        raw = data.astype('S')
+    except (TypeError, ValueError, UnicodeEncodeError):
+        return None
+    try:
+        # numpy's own bytes to str cast is fastest, but only handles ASCII.
+        return raw.astype('U')
+    except UnicodeDecodeError:
+        pass
+    try:
+        return np.char.decode(raw, 'utf-8')
+    except UnicodeDecodeError:
+        return None
+
+
 def sval_whole_column(single_column):
     """
     Returns a new column whose values are the string versions of the values
-    in the input column.  The new column also keeps the metadata from the input column.
+    in the input column.  The new column also keeps the metadata from the input
+    column and, for a MaskedColumn, its mask.
 
     Parameters
     ----------
@@ -176,9 +536,25 @@ def sval_whole_column(single_column):
     astropy.table.Column
         Stringified version of input column
     """
-    new_col = svalv(single_column)
-    new_col.meta = single_column.meta
-    return new_col
+    from astropy.table import Column, MaskedColumn
+
+    data = np.asarray(single_column)
+    new_data = _decode_array(data)
+    if new_data is None:
+        new_data = np.array(_decode_values(data.ravel().tolist()), dtype=str).reshape(data.shape)
+
+    kwargs = dict(name=single_column.name, unit=single_column.unit,
+                  description=single_column.description, format=single_column.format,
+                  meta=single_column.meta)
+    if isinstance(single_column, MaskedColumn):
+        return MaskedColumn(new_data, mask=single_column.mask, **kwargs)
+    return Column(new_data, **kwargs)
+
+
+def _has_bytes(single_column):
+    # Checks every cell, not just the first, since the first may be masked
+    # or None while later ones are bytes.
+    return any(type(v) is bytes for v in np.asarray(single_column).ravel().tolist())
 
 
 def stringify_table(t):
@@ -196,27 +572,53 @@ def stringify_table(t):
         The same table as input, but with bytes-valued cells replaced by strings.
     """
     # This mess will look for columns that should be strings and convert them.
-    if len(t) is 0:
+    if len(t) == 0:
         return   # Nothing to convert
 
     scols = []
     for col in t.columns:
         colobj = t.columns[col]
-        if (colobj.dtype == 'object' and isinstance(t[colobj.name][0], bytes)):
+        if colobj.dtype == 'object' and _has_bytes(colobj):
             scols.append(colobj.name)
 
     for colname in scols:
         t[colname] = sval_whole_column(t[colname])
 
 
-def query_loop(query_function, service, params, verbose=False):
-    # Only one service, which is expected to be a row of a Registry query result that has  service['access_url']
-    if verbose: print("    Querying service {}".format(html.unescape(service['access_url'])))
-    # Initialize a table to add results to:
-    service_results = []
-    for j, param in enumerate(params):
+def query_loop(query_function, service, params, verbose=False, max_workers=1):
+    """
+    Calls query_function(service=<access_url>, **param) for each dict in params,
+    where service is expected to be a row of a Registry query result (or a
+    dict) that has service['access_url'].
+
+    With max_workers > 1, up to that many calls run at once in a thread pool.
+    Either way the results are returned in the order of params, and a call
+    that raises does not stop the others: its place in the results is taken
+    by an empty Table whose meta['error'] holds the exception.
+
+    All the calls go to one host, so for connections to be reused,
+    sessions.session_pool's pool_maxsize should be at least max_workers.
+    """
+    access_url = html.unescape(service['access_url'])
+    if verbose: print("    Querying service {}".format(access_url))
+
+    def one_query(param):
+        try:
+            return query_function(service=access_url, **param)
+        except Exception as e:
+            from astropy.table import Table
+            print("ERROR querying {} with {}: {}".format(access_url, param, e))
+            return Table(meta={'url': access_url, 'error': e})
+
+    if max_workers is None or max_workers <= 1 or len(params) <= 1:
+        results = map(one_query, params)
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(params))) as executor:
+            results = list(executor.map(one_query, params))
 
-        result = query_function(service=html.unescape(service['access_url']), **param)
+    service_results = []
+    for j, result in enumerate(results):
         # Need a test that we got something back. Shouldn't error if not, just be empty
         if verbose:
             if len(result) > 0:
@@ -228,33 +630,210 @@ def query_loop(query_function, service, params, verbose=False):
     return service_results
 
 
-def try_query(url, retries=3, timeout=60, get_params=None, post_data=None, files=None):
-    """ A wrapper to the astroquery _request() function allowing for retries
+#
+# Opt-in cache of GET responses
+#
+
+_response_cache = None
+
+
+def enable_response_cache(directory=None, max_bytes=1024 ** 3, fresh_for=0., max_age=None):
+    """
+    Makes the Cone, Image and Spectra queries (and try_query calls with
+    cache=True) keep their GET responses in an on-disk ResponseCache, which is returned.  See
+    response_cache.ResponseCache for the parameters; its stats() method gives
+    the hit and miss counts.
+    """
+    global _response_cache
+    from .response_cache import ResponseCache
+    _response_cache = ResponseCache(directory=directory, max_bytes=max_bytes, fresh_for=fresh_for,
+                                    max_age=max_age)
+    return _response_cache
+
+
+def disable_response_cache():
+    """
+    Stops try_query from using the response cache.  The cache files are kept.
+    """
+    global _response_cache
+    _response_cache = None
+
+
+def get_response_cache():
+    """
+    Returns the ResponseCache set up by enable_response_cache(), or None.
+    """
+    return _response_cache
+
+
+ServiceResult = collections.namedtuple('ServiceResult', ['service', 'result', 'error', 'duration'])
+ServiceResult.__doc__ = """
+One service's outcome from search_services: the service, the value returned
+for it (None if it failed), the exception raised or the TimeoutError if it
+ran out of time (None if it succeeded), and the seconds it took.
+"""
+
+
+def search_services(search, services, max_workers=16, timeout=None):
     """
-    from requests.exceptions import (Timeout, ReadTimeout)
+    Calls search(service) for every service concurrently, and yields a
+    ServiceResult for each as soon as it finishes, fastest first.
+
+    Parameters
+    ----------
+    search : callable
+        Called with one service, e.g. a function wrapping Image.query.
+    services : iterable
+        The services, e.g. the rows of a Registry.query result table.
+    max_workers : int
+        The number of services queried at once.
+    timeout : float or None
+        Seconds after which a service that hasn't finished is given up on:
+        a ServiceResult with a TimeoutError is yielded for it, and its place
+        is taken by the next service.  Its thread can't be stopped, so it
+        runs on in the background (until its own HTTP timeouts expire) and
+        its result is dropped.
+
+    Yields
+    ------
+    ServiceResult
+        One per service, in order of completion.
+    """
+    import queue
+    import threading
+
+    services = list(services)
+    finished = queue.Queue()
+
+    def run(i):
+        try:
+            result, error = search(services[i]), None
+        except Exception as e:
+            result, error = None, e
+        finished.put((i, result, error))
+
+    next_index = 0
+    running = {}  # service index -> start time
+    while next_index < len(services) or running:
+        while next_index < len(services) and len(running) < max_workers:
+            running[next_index] = time.monotonic()
+            threading.Thread(target=run, args=(next_index,), daemon=True).start()
+            next_index += 1
+
+        wait_time = None
+        if timeout is not None:
+            wait_time = max(0, min(running.values()) + timeout - time.monotonic())
+        try:
+            i, result, error = finished.get(timeout=wait_time)
+        except queue.Empty:
+            now = time.monotonic()
+            for i, start in list(running.items()):
+                if now - start >= timeout:
+                    del running[i]
+                    error = TimeoutError("No result after {}s".format(timeout))
+                    yield ServiceResult(services[i], None, error, now - start)
+            continue
+
+        start = running.pop(i, None)
+        if start is not None:  # else it already timed out
+            yield ServiceResult(services[i], result, error, time.monotonic() - start)
+
+
+def try_query(url, retries=3, timeout=60, get_params=None, post_data=None, files=None, stream=False,
+              policy=None, breakers=circuit_breakers, headers=None, cache=False):
+    """ A wrapper around a request through the shared keep-alive session pool
+    (see sessions.session_pool), allowing for retries
+
+    With stream=True only the headers have been read on return, and the body
+    can be handed to astropy_table_from_votable_response without first being
+    loaded into memory.
+
+    Timeouts, connection errors and the HTTP statuses in policy.retry_statuses
+    are retried according to policy (a retry.RetryPolicy), which by default
+    makes up to retries attempts with jittered exponential backoff.  When
+    the attempts, the policy's deadline or its retry budget run out, the last
+    error is raised, or the last response returned if there was one.
+
+    Unless breakers is None, each result is recorded with the circuit breaker
+    for url's host (see retry.circuit_breakers), and while that breaker is
+    open, retry.CircuitOpenError is raised without sending a request.
+
+    A GET request goes through a response cache only if the caller asks for
+    it: cache=True uses the one set up by enable_response_cache() (if any),
+    or cache may be a response_cache.ResponseCache.  Only requests whose
+    answer doesn't change from one call to the next should be cached, so
+    e.g. job status polls must not be.  headers are extra request headers.
+    """
+    from requests.exceptions import (Timeout, ConnectionError)
     from urllib3.exceptions import ReadTimeoutError
-    from astroquery.query import BaseQuery
-    from IPython.core.debugger import Tracer
 
-    bq = BaseQuery()
-    retry = retries
     assert get_params is not None or post_data is not None, "Give either get_params or post_data"
 
-    while retry:
+    if cache is True:
+        cache = _response_cache
+    if cache and post_data is None:
+        def send(cache_headers):
+            all_headers = dict(headers or {}, **(cache_headers or {}))
+            return try_query(url, retries=retries, timeout=timeout, get_params=get_params, stream=True,
+                             policy=policy, breakers=breakers, headers=all_headers or None, cache=False)
+        return cache.fetch(url, get_params, send)
+
+    if policy is None:
+        policy = RetryPolicy(max_attempts=retries)
+    breaker = None if breakers is None else breakers.for_url(url)
+    deadline = None if policy.deadline is None else time.monotonic() + policy.deadline
+    if policy.budget is not None:
+        policy.budget.deposit()
+
+    attempt = 0
+    while True:
+        attempt += 1
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError("Circuit breaker for {} is open; not sending the request.".format(url))
+
+        attempt_timeout = timeout
+        if deadline is not None:
+            remaining = max(deadline - time.monotonic(), 0.001)
+            attempt_timeout = remaining if timeout is None else min(timeout, remaining)
+
+        error = None
         try:
             if post_data is not None:
-                response = bq._request('POST', url, data=post_data, cache=False, timeout=timeout, files=files)
-            else:
-                response = bq._request('GET', url, params=get_params, cache=False, timeout=timeout)
-            retry = retries-1
-        except (Timeout, ReadTimeout, ReadTimeoutError, ConnectionError) as e:
-            retry = retry-1
-            if retry == 0:
-                print("ERROR: Got another timeout; quitting.")
-                return response
+                response = session_pool.request('POST', url, data=post_data, timeout=attempt_timeout,
+                                                files=files, headers=headers, stream=stream)
             else:
-                print("WARNING: Got a timeout; trying again.")
-        except:
+                response = session_pool.request('GET', url, params=get_params, timeout=attempt_timeout,
+                                                headers=headers, stream=stream)
+        except (Timeout, ReadTimeoutError, ConnectionError) as e:
+            error, response = e, None
+            problem = "a timeout" if isinstance(e, (Timeout, ReadTimeoutError)) else "a connection error"
+        except Exception:
+            # Not retried, but it still counts against the host; otherwise a
+            # half-open breaker would wait for this trial's result forever.
+            if breaker is not None:
+                breaker.record_failure()
             raise
         else:
+            problem = "HTTP status {}".format(response.status_code)
+
+        if breaker is not None:
+            if error is not None or response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+        if error is None and response.status_code not in policy.retry_statuses:
             return response
+
+        delay = policy.delay(attempt)
+        if (attempt >= policy.max_attempts or
+                (deadline is not None and time.monotonic() + delay >= deadline) or
+                (policy.budget is not None and not policy.budget.withdraw())):
+            if error is not None:
+                print("ERROR: Got {} from {}; quitting.".format(problem, url))
+                raise error
+            return response
+
+        print("WARNING: Got {}; trying again in {:.1f}s.".format(problem, delay))
+        if response is not None:
+            response.close()
+        time.sleep(delay)
@@ -1,24 +1,27 @@
-from astropy.coordinates import SkyCoord
-from astropy.table import Table
-from astroquery.utils import parse_coordinates
-
-import warnings
-
 import html
-import requests
-import os
+import numpy as np
 import sys
 import pathlib
+import time
 
 from query_stats import Interval, QueryStats
+from votable_counter import VOTableCounter
+from result_sinks import make_sink
+from navoutils.sessions import session_pool
+from navoutils.utils import is_skycoord, parse_coordinates
+
 
 def time_this(interval_name):
     def time_this_decorator(func):
         def wrapper(*args, **kwargs):
+            # The interval is local to this call and is handed to the stats
+            # object (which serializes additions) even if func raises.
             interval = Interval(interval_name)
-            result = func(*args, **kwargs)
-            interval.close()
-            args[0].stats.add_interval(interval)
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                interval.close()
+                args[0].stats.add_interval(interval)
             
             return result
         return wrapper
@@ -28,7 +31,8 @@ class Query():
     """
     """
 
-    def __init__(self, base_name, query_type, service, coords, radius, out_dir, verbose=False):
+    def __init__(self, base_name, query_type, service, coords, radius, out_dir, verbose=False,
+                 sink='file', chunk_size=64 * 1024):
         self._base_name = base_name
         self._query_type = query_type
         self._orig_service = service
@@ -36,21 +40,55 @@ class Query():
         self._orig_radius = radius
         self._out_path = pathlib.Path(out_dir)
         self._verbose = verbose
+        self._sink_type = sink
+        self._chunk_size = chunk_size
+        self._sink = None
+        self._num_bytes = -1
+        self._counter = None
         
         self._access_url = self._compute_access_url(service)
         self._coords = self._compute_coords(coords)
         
         self._query_params = self._compute_query_params()
         self._query_name = self._compute_query_name()
-        self._filename = self._out_path / (self._query_name + '.xml')
         
         self._stats = QueryStats(self._query_name, self._base_name, 'cone', 
                                  self._access_url, self._query_params)
     
+    @classmethod
+    def from_positions(cls, base_name, query_type, service, positions, radius, out_dir, **kwargs):
+        """
+        Build one Query per position without going through SkyCoord.
+
+        positions may be an (N, 2) array-like of RA, Dec in degrees, or a
+        vector SkyCoord.  radius may be a single value or one per position.
+        Any other keyword arguments are passed to each Query.
+        """
+        if is_skycoord(positions):
+            ra = np.atleast_1d(positions.ra.deg)
+            dec = np.atleast_1d(positions.dec.deg)
+        else:
+            positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+            ra = positions[:, 0]
+            dec = positions[:, 1]
+        radii = np.broadcast_to(np.asarray(radius, dtype=float), ra.shape)
+
+        return [cls(base_name, query_type, service, (r, d), sr, out_dir, **kwargs)
+                for r, d, sr in zip(ra.tolist(), dec.tolist(), radii.tolist())]
+
     @property 
     def stats(self):
         return self._stats
     
+    @property
+    def access_url(self):
+        return self._access_url
+
+    # The ResultSink the response was written to (None until run).
+    @property
+    def sink(self):
+        return self._sink
+
     def run(self):
         response = self.do_query()
         self.stream_to_file(response)
@@ -58,14 +96,54 @@ class Query():
     
     @time_this('do_query')
     def do_query(self):
-        response = requests.get(self._access_url, self._query_params, stream=True)
+        response = session_pool.request('GET', self._access_url,
+                                        params=self._query_params, stream=True)
+        self._stats.connection_reused = response.connection_reused
+        self._record_connection_phases(response.timings)
         return response
     
     @time_this('stream_to_file')
     def stream_to_file(self, response):
-        with open(self._filename, 'wb+') as fd:
-            for chunk in response.iter_content(chunk_size=128):
-                fd.write(chunk)   
+        # Rows and columns are counted as the chunks arrive so the result
+        # metadata is ready without re-reading the file.  That is CPU time,
+        # so it is timed separately and left out of the transfer phase.
+        num_bytes = 0
+        counting = 0.
+        counter = VOTableCounter()
+        self._sink = make_sink(self._sink_type, self._out_path, self._query_name)
+        with self._sink as sink:
+            transfer_start = time.time()
+            for chunk in response.iter_content(chunk_size=self._chunk_size):
+                sink.write(chunk)
+                count_start = time.perf_counter()
+                counter.feed(chunk)
+                counting += time.perf_counter() - count_start
+                num_bytes += len(chunk)
+            transfer_end = time.time()
+            count_start = time.perf_counter()
+            counter.close()
+            counting_at_close = time.perf_counter() - count_start
+        self._num_bytes = num_bytes
+        self._counter = counter
+        # The counting is spread through the transfer, so these intervals
+        # have the right durations but only nominal end times.
+        self._record_transfer(Interval('transfer', transfer_start, transfer_end - counting), num_bytes)
+        self._stats.add_phase(Interval('count', transfer_start,
+                                       transfer_start + counting + counting_at_close))
+        self._stats.record_sink(sink.kind, sink.write_duration, sink.bytes_per_sec)
+
+    def _record_connection_phases(self, timings):
+        # Phases that did not happen (e.g., DNS on a reused connection) are
+        # recorded as zero-length intervals at the start of the TTFB phase.
+        ttfb_start, _ = timings['ttfb']
+        for phase in ('dns', 'connect', 'tls', 'ttfb'):
+            start, end = timings.get(phase, (ttfb_start, ttfb_start))
+            self._stats.add_phase(Interval(phase, start, end))
+
+    def _record_transfer(self, transfer, num_bytes):
+        self._stats.add_phase(transfer)
+        if transfer.duration > 0:
+            self._stats.bytes_per_sec = num_bytes / transfer.duration
                 
     def gather_response_metadata(self, response):
         result_meta = {
@@ -75,18 +153,26 @@ class Query():
             'num_columns': -1
         }
         try:
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                t = Table.read(self._filename, format='votable')
-                
-            result_meta['size'] = os.path.getsize(self._filename)
-            result_meta['num_rows'] = len(t)
-            result_meta['num_columns'] = len(t.columns)
+            result_meta['size'] = self._num_bytes
+            if self._counter.error is not None:
+                raise self._counter.error
+            result_meta['num_rows'] = self._counter.num_rows
+            result_meta['num_columns'] = self._counter.num_columns
         except Exception as e:
-            print(value=f'Error reading result table: {e}', file=sys.stderr, flush=True)
+            print(f'Error reading result table: {e}', file=sys.stderr, flush=True)
         finally:
             self._stats.result_meta = result_meta        
     
+    def record_failure(self):
+        # For a query whose run() raised: its stats are still reported, with
+        # no HTTP status, so that it counts as an error in summaries.
+        self._stats.result_meta = {
+            'status': None,
+            'size': -1,
+            'num_rows': -1,
+            'num_columns': -1
+        }
+
     def _compute_access_url(self, service):
         # Get the base URL from service, which might be a url string or a 
         # dictionary with an "access_url" key.
@@ -100,21 +186,27 @@ class Query():
         return access_url
     
     def _compute_coords(self, in_coords):
-        # Get the RA and Dec from in_coords.
-        coords = in_coords
-        if (type(in_coords) is tuple or type(in_coords) is list) and len(in_coords) == 2:
-            coords = parse_coordinates(f"{in_coords[0]} {in_coords[1]}")
+        # Get the RA and Dec, in degrees, from in_coords.  Plain numbers are
+        # used as is; astropy's coordinate parsing is only needed for strings,
+        # and a SkyCoord is only touched if that is what we were given.
+        if is_skycoord(in_coords):
+            return (in_coords.ra.deg, in_coords.dec.deg)
         elif type(in_coords) is str:
             coords = parse_coordinates(in_coords)
-        elif type(in_coords) is not SkyCoord:
+            return (coords.ra.deg, coords.dec.deg)
+        elif isinstance(in_coords, (tuple, list, np.ndarray)) and len(in_coords) == 2:
+            try:
+                return (float(in_coords[0]), float(in_coords[1]))
+            except (TypeError, ValueError):
+                coords = parse_coordinates(f"{in_coords[0]} {in_coords[1]}")
+                return (coords.ra.deg, coords.dec.deg)
+        else:
             raise ValueError(f"Cannot parse input coordinates {in_coords}")  
-        
-        return coords
     
     def _compute_query_params(self):
         params = {
-            'RA': self._coords.ra.deg,
-            'DEC': self._coords.dec.deg,
+            'RA': self._coords[0],
+            'DEC': self._coords[1],
             'SR': self._orig_radius
         }
         return params
@@ -0,0 +1,210 @@
+import asyncio
+import collections
+import functools
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+
+def _run_query(query):
+    # Run one query, returning its stats, which for a query that failed have
+    # no HTTP status.
+    try:
+        query.run()
+    except Exception as e:
+        print(f'Error reading result table: {e}', file=sys.stderr, flush=True)
+        query.record_failure()
+    return query.stats
+
+
+def _host_of(access_url):
+    return urlparse(access_url).netloc.lower()
+
+
+class AsyncQueryRunner():
+    """
+    Runs a batch of Query objects concurrently on an asyncio event loop.
+
+    Each Query.run() is scheduled on a worker thread owned by the runner, so
+    the do_query/stream_to_file intervals are still measured around the actual
+    request and exclude any time spent waiting for a concurrency slot.
+
+    At most max_concurrent queries are in flight at once, and at most
+    max_per_service of those may target the same service (access URL).
+    """
+
+    def __init__(self, max_concurrent=100, max_per_service=4):
+        if max_concurrent <= 0:
+            raise ValueError('max_concurrent must be a positive number.')
+        if max_per_service <= 0:
+            raise ValueError('max_per_service must be a positive number.')
+        self._max_concurrent = max_concurrent
+        self._max_per_service = max_per_service
+
+    @property
+    def max_concurrent(self):
+        return self._max_concurrent
+
+    @property
+    def max_per_service(self):
+        return self._max_per_service
+
+    def run(self, queries, on_complete=None):
+        """
+        Run all the queries and return their QueryStats, in the order the
+        queries were given.  Queries that failed are included, with a
+        status of None in their result_meta.
+
+        If on_complete is given, it is called with each query's QueryStats
+        as soon as that query finishes, and the stats are not kept, so run()
+        returns an empty list.  If on_complete raises, the remaining queries
+        still run, and the first such exception is raised once they have all
+        finished.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.run_async(queries, on_complete))
+        finally:
+            loop.close()
+
+    async def run_async(self, queries, on_complete=None):
+        """
+        Coroutine version of run() for callers that already have a loop.
+        """
+        queries = list(queries)
+        global_sem = asyncio.Semaphore(self._max_concurrent)
+        service_sems = {}
+        callback_errors = []
+        with ThreadPoolExecutor(max_workers=self._max_concurrent) as executor:
+            tasks = [self._run_one(query, executor, global_sem, service_sems, on_complete,
+                                   callback_errors)
+                     for query in queries]
+            results = await asyncio.gather(*tasks)
+
+        if callback_errors:
+            raise callback_errors[0]
+        return [stats for stats in results if stats is not None]
+
+    async def _run_one(self, query, executor, global_sem, service_sems, on_complete,
+                       callback_errors):
+        service_sem = service_sems.get(query.access_url)
+        if service_sem is None:
+            service_sem = asyncio.Semaphore(self._max_per_service)
+            service_sems[query.access_url] = service_sem
+
+        async with service_sem:
+            async with global_sem:
+                loop = asyncio.get_event_loop()
+                stats = await loop.run_in_executor(executor, _run_query, query)
+
+        if stats is not None and on_complete is not None:
+            # An exception here would abort the gather, and with it the
+            # queries still to run, so it is kept to be raised at the end.
+            try:
+                on_complete(stats)
+            except Exception as e:
+                callback_errors.append(e)
+            return None
+        return stats
+
+
+class ThreadPoolQueryRunner():
+    """
+    Runs a batch of Query objects on a thread pool, for environments where
+    an event loop is not an option.
+
+    At most max_concurrent queries are in flight at once, and at most
+    max_per_host of those may target the same access URL host.  Queries
+    waiting on a busy host do not hold a worker thread, so other hosts
+    keep making progress.
+    """
+
+    def __init__(self, max_concurrent=32, max_per_host=4):
+        if max_concurrent <= 0:
+            raise ValueError('max_concurrent must be a positive number.')
+        if max_per_host <= 0:
+            raise ValueError('max_per_host must be a positive number.')
+        self._max_concurrent = max_concurrent
+        self._max_per_host = max_per_host
+
+    @property
+    def max_concurrent(self):
+        return self._max_concurrent
+
+    @property
+    def max_per_host(self):
+        return self._max_per_host
+
+    def run(self, queries, on_complete=None):
+        """
+        Run all the queries and return their QueryStats, in the order the
+        queries were given.  Queries that failed are included, with a
+        status of None in their result_meta.
+
+        If on_complete is given, it is called (from a worker thread) with
+        each query's QueryStats as soon as that query finishes,
+        and the stats are not kept, so run() returns an empty list.  If
+        on_complete raises, the remaining queries still run, and the first
+        such exception is raised once they have all finished.
+        """
+        queries = list(queries)
+        results = [None] * len(queries)
+        if len(queries) == 0:
+            return []
+
+        lock = threading.Lock()
+        all_done = threading.Event()
+        remaining = [len(queries)]
+        callback_errors = []
+        pending = collections.OrderedDict()
+        in_flight = collections.Counter()
+        for i, query in enumerate(queries):
+            pending.setdefault(_host_of(query.access_url), collections.deque()).append(i)
+
+        with ThreadPoolExecutor(max_workers=self._max_concurrent) as executor:
+
+            def submit(i, host):
+                future = executor.submit(_run_query, queries[i])
+                future.add_done_callback(functools.partial(finished, i, host))
+
+            def finished(i, host, future):
+                # The bookkeeping must happen even if on_complete raises, or
+                # the host's next query is never submitted and run() hangs.
+                # (Exceptions raised here would only be logged by the pool.)
+                try:
+                    stats = future.result()
+                    if stats is not None and on_complete is not None:
+                        on_complete(stats)
+                    else:
+                        results[i] = stats
+                except Exception as e:
+                    with lock:
+                        callback_errors.append(e)
+                finally:
+                    next_i = None
+                    with lock:
+                        remaining[0] -= 1
+                        if pending[host]:
+                            next_i = pending[host].popleft()
+                        else:
+                            in_flight[host] -= 1
+                        if remaining[0] == 0:
+                            all_done.set()
+                    if next_i is not None:
+                        submit(next_i, host)
+
+            to_submit = []
+            with lock:
+                for host, indices in pending.items():
+                    while indices and in_flight[host] < self._max_per_host:
+                        in_flight[host] += 1
+                        to_submit.append((indices.popleft(), host))
+            for i, host in sorted(to_submit):
+                submit(i, host)
+
+            all_done.wait()
+
+        if callback_errors:
+            raise callback_errors[0]
+        return [stats for stats in results if stats is not None]
@@ -1,12 +1,19 @@
+import collections
+import threading
 import time
         
 class Interval():
     """
+    A named span of time.  By default it starts now and is ended by close(),
+    but explicit start and end times (from time.time()) can be given for
+    spans that were measured elsewhere.
     """
-    def __init__(self, desc):
+    __slots__ = ('_desc', '_start_time', '_end_time')
+
+    def __init__(self, desc, start_time=None, end_time=None):
         self._desc = desc 
-        self._start_time = time.time()
-        self._end_time = self._start_time
+        self._start_time = time.time() if start_time is None else start_time
+        self._end_time = self._start_time if end_time is None else end_time
         
     def close(self):
         self._end_time = time.time()
@@ -23,6 +30,17 @@ class Interval():
 class QueryStats():
     """
     """
+    # Request phases, each with its own duration column.  dns, connect and
+    # tls are zero when an open connection was reused.  count is the time
+    # spent counting the result's rows and columns as it arrived, which is
+    # not part of transfer.
+    PHASES = ('dns', 'connect', 'tls', 'ttfb', 'transfer', 'count')
+
+    __slots__ = ('_name', '_base_name', '_query_type', '_access_url', '_query_params',
+                 '_intervals', '_result_meta', '_connection_reused', '_phases',
+                 '_bytes_per_sec', '_sink', '_sink_write_duration', '_sink_bytes_per_sec',
+                 '_start_time', '_end_time', '_lock')
+
     def __init__(self, name, base_name, query_type, access_url, query_params):
         self._name = name
         self._base_name = base_name
@@ -31,13 +49,65 @@ class QueryStats():
         self._query_params = query_params
         self._intervals = []
         self._result_meta = {}
+        self._connection_reused = None
+        self._phases = {}
+        self._bytes_per_sec = None
+        self._sink = None
+        self._sink_write_duration = None
+        self._sink_bytes_per_sec = None
+        self._start_time = None
+        self._end_time = None
+        self._lock = threading.Lock()
         
     def add_interval(self, interval):
-        if len(self._intervals) == 0:
-            self._start_time = time.time()
-        self._end_time = interval._end_time
-        self._intervals.append(interval)
+        # Queries may be run from worker threads, so guard the interval
+        # list and the start/end times as a unit.
+        with self._lock:
+            if len(self._intervals) == 0:
+                self._start_time = interval._start_time
+            self._end_time = interval._end_time
+            self._intervals.append(interval)
+
+    @property
+    def intervals(self):
+        with self._lock:
+            return list(self._intervals)
         
+    def add_phase(self, interval):
+        # interval.desc should be one of PHASES.
+        with self._lock:
+            self._phases[interval.desc] = interval
+
+    def phase(self, desc):
+        with self._lock:
+            return self._phases.get(desc)
+
+    # Body transfer rate, i.e. response bytes / transfer phase duration.
+    @property
+    def bytes_per_sec(self):
+        return self._bytes_per_sec
+
+    @bytes_per_sec.setter
+    def bytes_per_sec(self, value):
+        self._bytes_per_sec = value
+
+    def record_sink(self, kind, write_duration, bytes_per_sec):
+        # Time spent storing the response and the resulting storage rate,
+        # so that disk cost can be separated from network cost.
+        self._sink = kind
+        self._sink_write_duration = write_duration
+        self._sink_bytes_per_sec = bytes_per_sec
+
+    # Whether the query's request went over an already open (keep-alive)
+    # connection.  None if not known.
+    @property
+    def connection_reused(self):
+        return self._connection_reused
+
+    @connection_reused.setter
+    def connection_reused(self, value):
+        self._connection_reused = value
+
     # property result metadata
     @property
     def result_meta(self):
@@ -49,13 +119,20 @@ class QueryStats():
         
     def _columns(self):
         cols = ['name', 'start_time', 'end_time']
-        for i, interval in enumerate(self._intervals):
+        for i, interval in enumerate(self.intervals):
             cols.append(f'int{i}_desc')
             cols.append(f'int{i}_duration')
+        for phase in self.PHASES:
+            cols.append(f'{phase}_duration')
+        cols.append('bytes_per_sec')
+        cols.append('sink')
+        cols.append('sink_write_duration')
+        cols.append('sink_bytes_per_sec')
         cols.append('base_name')
         cols.append('query_type')
         cols.extend(list(self._query_params.keys()))
         cols.append('access_url')
+        cols.append('connection_reused')
         cols.extend(list(self._result_meta.keys()))
         return cols
     
@@ -65,17 +142,29 @@ class QueryStats():
         vals.append(self._start_time)
         vals.append(self._end_time)
         
-        for interval in self._intervals:
+        for interval in self.intervals:
             vals.append(interval.desc)
             vals.append(interval.duration)
+        for phase in self.PHASES:
+            interval = self.phase(phase)
+            vals.append(None if interval is None else interval.duration)
+        vals.append(self._bytes_per_sec)
+        vals.append(self._sink)
+        vals.append(self._sink_write_duration)
+        vals.append(self._sink_bytes_per_sec)
     
         vals.append(self._base_name)
         vals.append(self._query_type)        
         vals.extend(list(self._query_params.values()))
         vals.append(self._access_url)
+        vals.append(self._connection_reused)
         vals.extend(list(self._result_meta.values()))
         return vals
     
+    def row_dict(self):
+        # Column name -> value, e.g. for appending to a StatsStore.
+        return collections.OrderedDict(zip(self._columns(), self._row_values()))
+
     def header_string(self):
         hdr = ",".join(self._columns()) + '\n'
         return hdr
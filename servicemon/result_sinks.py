@@ -0,0 +1,163 @@
+import gzip
+import io
+import time
+
+
+class ResultSink():
+    """
+    Destination for the bytes of one query's response.
+
+    A sink is opened, written in chunks, then closed (it can also be used as a
+    context manager).  The time spent inside write() is accumulated so that
+    the cost of storing the result can be told apart from the network cost.
+
+    Subclasses implement _open(), _write() and _close().
+    """
+    kind = None
+
+    def __init__(self, out_path, name):
+        self._out_path = out_path
+        self._name = name
+        self._num_bytes = 0
+        self._write_duration = 0.0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def location(self):
+        # Where the result ends up, or None if it isn't kept on disk.
+        return None
+
+    @property
+    def num_bytes(self):
+        return self._num_bytes
+
+    @property
+    def write_duration(self):
+        return self._write_duration
+
+    @property
+    def bytes_per_sec(self):
+        if self._write_duration > 0:
+            return self._num_bytes / self._write_duration
+        return None
+
+    def open(self):
+        start = time.perf_counter()
+        self._open()
+        self._write_duration += time.perf_counter() - start
+
+    def write(self, chunk):
+        start = time.perf_counter()
+        self._write(chunk)
+        self._write_duration += time.perf_counter() - start
+        self._num_bytes += len(chunk)
+
+    def close(self):
+        # Closing flushes any buffered data, so it counts as write time.
+        start = time.perf_counter()
+        self._close()
+        self._write_duration += time.perf_counter() - start
+
+    def _open(self):
+        pass
+
+    def _write(self, chunk):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+
+class FileSink(ResultSink):
+    """
+    Writes the result to <out_path>/<name>.xml through a large write buffer.
+    """
+    kind = 'file'
+
+    def __init__(self, out_path, name, buffer_size=1024 * 1024):
+        super().__init__(out_path, name)
+        self._buffer_size = buffer_size
+        self._fd = None
+
+    @property
+    def location(self):
+        return self._out_path / (self._name + '.xml')
+
+    def _open(self):
+        self._fd = open(self.location, 'wb', buffering=self._buffer_size)
+
+    def _write(self, chunk):
+        self._fd.write(chunk)
+
+    def _close(self):
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+
+class GzipFileSink(FileSink):
+    """
+    Writes the result gzip-compressed to <out_path>/<name>.xml.gz.
+    """
+    kind = 'gzip'
+
+    def __init__(self, out_path, name, buffer_size=1024 * 1024, compresslevel=6):
+        super().__init__(out_path, name, buffer_size=buffer_size)
+        self._compresslevel = compresslevel
+
+    @property
+    def location(self):
+        return self._out_path / (self._name + '.xml.gz')
+
+    def _open(self):
+        gz = gzip.open(self.location, 'wb', compresslevel=self._compresslevel)
+        self._fd = io.BufferedWriter(gz, buffer_size=self._buffer_size)
+
+
+class MemorySink(ResultSink):
+    """
+    Keeps the result in memory; getvalue() returns it.
+    """
+    kind = 'memory'
+
+    def __init__(self, out_path, name):
+        super().__init__(out_path, name)
+        self._buffer = io.BytesIO()
+
+    def getvalue(self):
+        return self._buffer.getvalue()
+
+    def _write(self, chunk):
+        self._buffer.write(chunk)
+
+
+class DiscardSink(ResultSink):
+    """
+    Drops the result, for latency-only monitoring.
+    """
+    kind = 'discard'
+
+    def _write(self, chunk):
+        pass
+
+
+SINKS = {sink.kind: sink for sink in (FileSink, GzipFileSink, MemorySink, DiscardSink)}
+
+
+def make_sink(sink, out_path, name):
+    """
+    Create a sink for one query.  sink may be one of the SINKS keys
+    ('file', 'gzip', 'memory' or 'discard'), or a callable taking
+    (out_path, name) such as a ResultSink subclass.
+    """
+    if isinstance(sink, str):
+        if sink not in SINKS:
+            raise ValueError(f'sink must be one of {", ".join(SINKS)}.')
+        sink = SINKS[sink]
+    return sink(out_path, name)
@@ -1,17 +1,15 @@
-from astropy.coordinates import SkyCoord
-
 import sys
 
 from query import Query
+from query_runner import AsyncQueryRunner
+from stats_store import StatsStore
        
 def print_stats(stats):
-    # print stats
+    # print stats, with one column set covering every row
     if len(stats) > 0:
-        stat_string = ''
-        stat_string += stats[0].header_string()
-        for stat_instance in stats:
-            stat_string += stat_instance.values_string()
-        print(stat_string)
+        store = StatsStore()
+        store.extend(stats)
+        store.write_csv(sys.stdout)
     else:
         print('No stats collected.')
     
@@ -29,22 +27,60 @@ cones = [
     ((125.7, 21.5), 0.5)
 ]
         
-def do_queries():
-    stats = []
+
+def build_queries():
+    queries = []
     
     for service in services:
         for cone in cones:
             try:
                 query = Query(service['base_name'], service['service_type'], 
                               service, cone[0], cone[1], 'results')
-                query.run()
             except Exception as e:
-                print(f'Error reading result table: {e}', file=sys.stderr, flush=True)
+                print(f'Error creating query: {e}', file=sys.stderr, flush=True)
             else:
-                stats.append(query.stats)
+                queries.append(query)
+
+    return queries
+
+
+def run_serially(queries, on_complete=None):
+    stats = []
+
+    for query in queries:
+        try:
+            query.run()
+        except Exception as e:
+            print(f'Error reading result table: {e}', file=sys.stderr, flush=True)
+            query.record_failure()
+        if on_complete is None:
+            stats.append(query.stats)
+        else:
+            on_complete(query.stats)
+
+    return stats
+
+
+def do_queries(runner=None, writer=None):
+    """
+    Run the services x cones matrix.  With no runner the queries are run
+    one after another; otherwise they are handed to the runner (e.g., an
+    AsyncQueryRunner or ThreadPoolQueryRunner) to be run concurrently.
+
+    With a writer (e.g., a CsvStatsWriter or JsonLinesStatsWriter), each
+    query's stats are written as soon as it completes instead of being
+    collected and printed at the end.
+    """
+    queries = build_queries()
+    on_complete = None if writer is None else writer.write
+    if runner is None:
+        stats = run_serially(queries, on_complete)
+    else:
+        stats = runner.run(queries, on_complete=on_complete)
         
-    print_stats(stats)
+    if writer is None:
+        print_stats(stats)
 
 
 if __name__ == '__main__':
-    do_queries()
+    do_queries(AsyncQueryRunner())
@@ -0,0 +1,226 @@
+import heapq
+import itertools
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from query import Query
+from navoutils.retry import circuit_breakers
+
+
+class TokenBucket():
+    """
+    Thread-safe token bucket allowing on average rate acquisitions per second,
+    with bursts of up to burst acquisitions.
+    """
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise ValueError('rate must be a positive number.')
+        if burst < 1:
+            raise ValueError('burst must be at least 1.')
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, first sleeping until one is available.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            # Reserve the token now (possibly going negative) so that waiting
+            # callers are served in order without re-checking.
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """
+        Takes a token if one is available now and returns 0; otherwise takes
+        nothing and returns the seconds until one will be.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self._rate
+
+
+class MonitorScheduler():
+    """
+    Long-running monitor that repeatedly queries every service for every cone.
+
+    Each service is queried once per cone every period seconds (or the value
+    of the service's own 'period' key).  To keep the load steady, each service
+    starts at a random offset within its period, its cones are spread evenly
+    over the period, and each query is delayed by a random jitter of up to
+    jitter times that spacing.  Times are computed from the schedule's start,
+    not from when the previous query finished, so they do not drift.
+
+    Requests to each access URL host are further limited by a token bucket to
+    host_rate per second (bursts of host_burst).  A query whose host has no
+    token is put back in the schedule for when it will have one, so it never
+    holds a worker while it waits, and queries are only handed to the pool
+    when a worker is free.
+
+    Each query's QueryStats is passed to on_complete (e.g., the write method
+    of a StatsWriter) when it finishes, including those of queries that
+    failed, whose status is None.  query_kwargs are passed to every Query,
+    e.g. sink='discard' for latency-only monitoring.
+
+    With skip_unhealthy_hosts=True, each result is recorded with the host's
+    circuit breaker (see navoutils.retry.circuit_breakers), and queries to a
+    host whose breaker is open are skipped rather than tying up a worker,
+    except for the periodic trial query that checks whether it has recovered.
+    """
+    def __init__(self, services, cones, out_dir, period=300., jitter=0.5,
+                 host_rate=1., host_burst=1, max_workers=16, on_complete=None,
+                 seed=None, skip_unhealthy_hosts=False, **query_kwargs):
+        if period <= 0:
+            raise ValueError('period must be a positive number.')
+        if not 0 <= jitter <= 1:
+            raise ValueError('jitter must be in the range [0,1].')
+        self._services = list(services)
+        self._cones = list(cones)
+        self._out_dir = out_dir
+        self._period = period
+        self._jitter = jitter
+        self._host_rate = host_rate
+        self._host_burst = host_burst
+        self._max_workers = max_workers
+        self._on_complete = on_complete
+        self._skip_unhealthy_hosts = skip_unhealthy_hosts
+        self._query_kwargs = query_kwargs
+        self._random = random.Random(seed)
+
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def stop(self):
+        """
+        Ask run() to return; queries already started are allowed to finish.
+        """
+        self._stop.set()
+
+    def run(self, duration=None):
+        """
+        Run the schedule until stop() is called or, if given, for duration
+        seconds.
+        """
+        self._stop.clear()
+        start = time.monotonic()
+        end = None if duration is None else start + duration
+
+        # Heap of (due time, sequence, nominal time, service index, cone
+        # index).  It is ordered by the jittered due time, so one query's
+        # jitter never holds up another's; the nominal time is only used to
+        # compute the next one, so the schedule doesn't drift.  The sequence
+        # number keeps entries with equal times in insertion order.
+        sequence = itertools.count()
+        heap = []
+
+        def schedule(nominal, s, c):
+            spacing = self._service_period(self._services[s]) / max(len(self._cones), 1)
+            due = nominal + self._random.uniform(0, self._jitter * spacing)
+            heapq.heappush(heap, (due, next(sequence), nominal, s, c))
+
+        for s, service in enumerate(self._services):
+            period = self._service_period(service)
+            offset = self._random.uniform(0, period)
+            spacing = period / max(len(self._cones), 1)
+            for c in range(len(self._cones)):
+                schedule(start + offset + c * spacing, s, c)
+
+        # Queries are only submitted when a worker is free, so the executor's
+        # queue can't grow without bound when queries are slow.
+        free_workers = threading.Semaphore(self._max_workers)
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            while heap and not self._stop.is_set():
+                due, _, nominal, s, c = heapq.heappop(heap)
+                if end is not None and due >= end:
+                    break
+                if self._stop.wait(max(0, due - time.monotonic())):
+                    break
+
+                # The host's rate limit is applied here rather than in the
+                # worker, so a busy host delays only its own queries and
+                # never ties up workers.
+                service = self._services[s]
+                wait = self._bucket_for(service['access_url']).try_acquire()
+                if wait > 0:
+                    heapq.heappush(heap, (time.monotonic() + wait, next(sequence), nominal, s, c))
+                    continue
+
+                while not free_workers.acquire(timeout=0.1):
+                    if self._stop.is_set():
+                        return
+                future = executor.submit(self._run_query, service, self._cones[c])
+                future.add_done_callback(lambda f: free_workers.release())
+                schedule(nominal + self._service_period(service), s, c)
+
+    def _service_period(self, service):
+        return service.get('period', self._period)
+
+    def _bucket_for(self, access_url):
+        host = urlparse(access_url).netloc.lower()
+        with self._buckets_lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self._host_rate, self._host_burst)
+                self._buckets[host] = bucket
+        return bucket
+
+    def _run_query(self, service, cone):
+        breaker = None
+        query = None
+        try:
+            query = Query(service['base_name'], service['service_type'], service,
+                          cone[0], cone[1], self._out_dir, **self._query_kwargs)
+            if self._skip_unhealthy_hosts:
+                breaker = circuit_breakers.for_url(query.access_url)
+                if not breaker.allow():
+                    print(f'Skipping query to unhealthy host: {query.access_url}', file=sys.stderr, flush=True)
+                    return
+            query.run()
+        except Exception as e:
+            if breaker is not None:
+                breaker.record_failure()
+            print(f'Error running query: {e}', file=sys.stderr, flush=True)
+            if query is None:
+                return
+            query.record_failure()
+        else:
+            if breaker is not None:
+                status = query.stats.result_meta.get('status')
+                if status is None or status >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+        if self._on_complete is not None:
+            self._on_complete(query.stats)
+
+
+if __name__ == '__main__':
+    from run import services, cones
+    from stats_writer import JsonLinesStatsWriter
+
+    with JsonLinesStatsWriter('monitor_stats.jsonl', flush_every=1) as writer:
+        scheduler = MonitorScheduler(services, cones, 'results', period=60.,
+                                     on_complete=writer.write)
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            scheduler.stop()
@@ -0,0 +1,198 @@
+import array
+import collections
+import csv
+import math
+import numbers
+
+_MISSING = float('nan')
+
+
+def _kind_of(value):
+    # bool is an Integral, but is kept as an object so it prints as True/False.
+    if isinstance(value, bool):
+        return 'object'
+    if isinstance(value, numbers.Integral):
+        return 'int'
+    if isinstance(value, numbers.Real):
+        return 'float'
+    return 'object'
+
+
+class _Column():
+    """
+    One column of a StatsStore.  int and float columns are held in a double
+    array (NaN marks a missing value); anything else is held in a list.
+
+    The kind is decided by the first value that isn't None (e.g., a failed
+    query's missing durations don't make a numeric column a list); until
+    then, only the number of missing values is kept.
+    """
+    __slots__ = ('kind', 'values', 'pending')
+
+    def __init__(self, num_missing):
+        self.kind = None
+        self.values = None
+        self.pending = num_missing
+
+    def __len__(self):
+        return self.pending if self.kind is None else len(self.values)
+
+    def append(self, value):
+        if value is None:
+            if self.kind is None:
+                self.pending += 1
+            else:
+                self.values.append(None if self.kind == 'object' else _MISSING)
+            return
+        kind = _kind_of(value)
+        if self.kind is None:
+            self.kind = kind
+            if kind == 'object':
+                self.values = [None] * self.pending
+            else:
+                self.values = array.array('d', [_MISSING]) * self.pending
+        elif self.kind != 'object':
+            if kind == 'object':
+                self._to_object()
+            elif kind == 'float':
+                self.kind = 'float'
+        self.values.append(value)
+
+    def get(self, index):
+        if self.kind is None:
+            if not -self.pending <= index < self.pending:
+                raise IndexError('column index out of range')
+            return None
+        value = self.values[index]
+        if self.kind == 'object':
+            return value
+        if math.isnan(value):
+            return None
+        return int(value) if self.kind == 'int' else value
+
+    def _to_object(self):
+        self.values = [self.get(i) for i in range(len(self.values))]
+        self.kind = 'object'
+
+
+class StatsRow():
+    """
+    Lightweight view of one row of a StatsStore, indexed by column name.
+    """
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    def __getitem__(self, colname):
+        return self._store.value(colname, self._index)
+
+    def as_dict(self):
+        return collections.OrderedDict(
+            (name, self._store.value(name, self._index)) for name in self._store.colnames)
+
+
+class StatsStore():
+    """
+    Columnar store for the stats of many queries.
+
+    Appending a QueryStats (or a dict of column values) is O(1) in the number
+    of rows already stored.  Numeric columns live in compact arrays that can be
+    copied to numpy in a single step, and the CSV output is written row by row
+    rather than built up as one string.
+
+    Rows need not all have the same columns; a column first seen part way
+    through a run is back-filled as missing for the earlier rows, and a column
+    absent from a row is missing for that row.  Missing values read as None
+    and are written to CSV as empty fields.
+    """
+    __slots__ = ('_columns', '_num_rows')
+
+    def __init__(self):
+        self._columns = collections.OrderedDict()
+        self._num_rows = 0
+
+    def __len__(self):
+        return self._num_rows
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._num_rows
+        if not 0 <= index < self._num_rows:
+            raise IndexError('StatsStore index out of range')
+        return StatsRow(self, index)
+
+    @property
+    def colnames(self):
+        return list(self._columns.keys())
+
+    def append(self, stats):
+        """
+        Append the row for one QueryStats.
+        """
+        self.append_row(stats.row_dict())
+
+    def extend(self, stats_list):
+        for stats in stats_list:
+            self.append(stats)
+
+    def append_row(self, row):
+        """
+        Append a row given as a mapping of column name to value.
+        """
+        for name, value in row.items():
+            col = self._columns.get(name)
+            if col is None:
+                col = _Column(self._num_rows)
+                self._columns[name] = col
+            col.append(value)
+        self._num_rows += 1
+        for col in self._columns.values():
+            if len(col) < self._num_rows:
+                col.append(None)
+
+    def value(self, colname, index):
+        return self._columns[colname].get(index)
+
+    def column(self, colname):
+        """
+        Returns a copy of a column as a numpy array.  Numeric columns are
+        float64 (NaN where missing), except that int columns with no missing
+        values are returned as int64.  A column with no values yet is all
+        NaN.  The copy is taken in one step from the
+        compact storage, and leaves the store free to keep growing.
+        """
+        import numpy as np
+
+        col = self._columns[colname]
+        if col.kind is None:
+            return np.full(col.pending, np.nan)
+        if col.kind == 'object':
+            return np.array(col.values, dtype=object)
+        # Not np.frombuffer: a view would pin the array's buffer, so that the
+        # next append raised BufferError, and would let callers write to it.
+        values = np.array(col.values, dtype=np.float64)
+        if col.kind == 'int' and not np.isnan(values).any():
+            return values.astype(np.int64)
+        return values
+
+    def to_arrays(self):
+        """
+        Returns an ordered dict of column name to numpy array (see column()).
+        """
+        return collections.OrderedDict((name, self.column(name)) for name in self._columns)
+
+    def write_csv(self, fd):
+        """
+        Writes a header line and one line per row to the file-like object fd.
+        """
+        writer = csv.writer(fd, lineterminator='\n')
+        writer.writerow(self._columns.keys())
+        getters = [col.get for col in self._columns.values()]
+        for i in range(self._num_rows):
+            row = []
+            for get in getters:
+                value = get(i)
+                row.append('' if value is None else value)
+            writer.writerow(row)
@@ -0,0 +1,383 @@
+import collections
+import math
+
+from query_stats import QueryStats
+from stats_store import StatsStore
+
+DEFAULT_PERCENTILES = (50, 95, 99)
+
+
+def _interval_samples(row):
+    # Yields (interval description, duration) for each interval and phase
+    # in a row of stats (see QueryStats.row_dict).
+    i = 0
+    while f'int{i}_desc' in row:
+        duration = row.get(f'int{i}_duration')
+        if row[f'int{i}_desc'] is not None and duration is not None:
+            yield (row[f'int{i}_desc'], duration)
+        i += 1
+    for phase in QueryStats.PHASES:
+        duration = row.get(f'{phase}_duration')
+        if duration is not None:
+            yield (phase, duration)
+
+
+def _is_error(status):
+    # A query counts as an error if it got no HTTP status or a 4xx/5xx one.
+    return status is None or (isinstance(status, float) and math.isnan(status)) or status >= 400
+
+
+def _percentile_name(p):
+    return f'p{p:g}'
+
+
+class QuantileSketch():
+    """
+    Mergeable streaming quantile sketch for non-negative values such as
+    durations (the DDSketch algorithm).
+
+    Values are counted in logarithmically sized buckets, so any quantile is
+    returned to within relative_accuracy of the true value while memory grows
+    only with the log of the value range, not with the number of samples.
+    Sketches with the same relative_accuracy can be merged, e.g. to combine
+    runs or workers, and round-trip through to_dict()/from_dict().
+    """
+    __slots__ = ('_relative_accuracy', '_gamma', '_log_gamma', '_buckets',
+                 '_zero_count', '_count', '_sum', '_min', '_max')
+
+    # Values at or below this are counted as zero.
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy=0.01):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('relative_accuracy must be in the range (0,1).')
+        self._relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._buckets = collections.Counter()
+        self._zero_count = 0
+        self._count = 0
+        self._sum = 0.0
+        self._min = math.inf
+        self._max = -math.inf
+
+    @property
+    def relative_accuracy(self):
+        return self._relative_accuracy
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def mean(self):
+        return self._sum / self._count if self._count else None
+
+    @property
+    def min(self):
+        return self._min if self._count else None
+
+    @property
+    def max(self):
+        return self._max if self._count else None
+
+    def add(self, value):
+        if value < 0:
+            raise ValueError('QuantileSketch values must not be negative.')
+        if value <= self.MIN_VALUE:
+            self._zero_count += 1
+        else:
+            self._buckets[math.ceil(math.log(value) / self._log_gamma)] += 1
+        self._count += 1
+        self._sum += value
+        self._min = min(self._min, value)
+        self._max = max(self._max, value)
+
+    def add_many(self, values):
+        """
+        Adds a numpy array (or sequence) of values in one vectorized step.
+        """
+        import numpy as np
+
+        values = np.asarray(values, dtype=float).ravel()
+        if len(values) == 0:
+            return
+        if (values < 0).any():
+            raise ValueError('QuantileSketch values must not be negative.')
+        positive = values[values > self.MIN_VALUE]
+        indices, counts = np.unique(np.ceil(np.log(positive) / self._log_gamma).astype(np.int64),
+                                    return_counts=True)
+        self._buckets.update(dict(zip(indices.tolist(), counts.tolist())))
+        self._zero_count += len(values) - len(positive)
+        self._count += len(values)
+        self._sum += float(values.sum())
+        self._min = min(self._min, float(values.min()))
+        self._max = max(self._max, float(values.max()))
+
+    def merge(self, other):
+        """
+        Adds the counts of another sketch into this one.
+        """
+        if other._relative_accuracy != self._relative_accuracy:
+            raise ValueError('Only sketches with the same relative_accuracy can be merged.')
+        self._buckets.update(other._buckets)
+        self._zero_count += other._zero_count
+        self._count += other._count
+        self._sum += other._sum
+        self._min = min(self._min, other._min)
+        self._max = max(self._max, other._max)
+        return self
+
+    def quantile(self, q):
+        """
+        Returns the approximate q-quantile (0 <= q <= 1), or None if empty.
+        """
+        if not 0 <= q <= 1:
+            raise ValueError('q must be in the range [0,1].')
+        if self._count == 0:
+            return None
+        rank = q * (self._count - 1)
+        if rank < self._zero_count:
+            return 0.0
+        seen = self._zero_count
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen > rank:
+                value = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(value, self._min), self._max)
+        return self._max
+
+    def to_dict(self):
+        return {
+            'relative_accuracy': self._relative_accuracy,
+            'buckets': {str(k): v for k, v in self._buckets.items()},
+            'zero_count': self._zero_count,
+            'count': self._count,
+            'sum': self._sum,
+            'min': self.min,
+            'max': self.max
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        sketch = cls(d['relative_accuracy'])
+        sketch._buckets.update({int(k): v for k, v in d['buckets'].items()})
+        sketch._zero_count = d['zero_count']
+        sketch._count = d['count']
+        sketch._sum = d['sum']
+        if sketch._count:
+            sketch._min = d['min']
+            sketch._max = d['max']
+        return sketch
+
+
+class _GroupTotals():
+    """
+    Per-group query count, error count and time span.
+    """
+    __slots__ = ('queries', 'errors', 'start_time', 'end_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.errors = 0
+        self.start_time = math.inf
+        self.end_time = -math.inf
+
+    def merge(self, other):
+        self.queries += other.queries
+        self.errors += other.errors
+        self.start_time = min(self.start_time, other.start_time)
+        self.end_time = max(self.end_time, other.end_time)
+
+    def values(self):
+        span = self.end_time - self.start_time
+        return collections.OrderedDict([
+            ('queries', self.queries),
+            ('error_rate', self.errors / self.queries if self.queries else None),
+            ('throughput', self.queries / span if span > 0 else None)
+        ])
+
+
+class LatencyAggregator():
+    """
+    Streaming per-group, per-interval latency summaries.
+
+    Each added QueryStats updates a QuantileSketch for every one of its
+    intervals and phases, plus the query and error counts and the time span
+    of its group (by default, its service's base_name).  No samples are
+    kept, and aggregators from different runs or workers can be merged.
+    """
+    def __init__(self, group_by='base_name', relative_accuracy=0.01):
+        self._group_by = group_by
+        self._relative_accuracy = relative_accuracy
+        self._sketches = collections.OrderedDict()
+        self._totals = collections.OrderedDict()
+
+    def add(self, stats):
+        self.add_row(stats.row_dict())
+
+    def add_row(self, row):
+        group = row.get(self._group_by)
+        totals = self._totals.get(group)
+        if totals is None:
+            totals = self._totals[group] = _GroupTotals()
+        totals.queries += 1
+        if _is_error(row.get('status')):
+            totals.errors += 1
+        if row.get('start_time') is not None:
+            totals.start_time = min(totals.start_time, row['start_time'])
+            totals.end_time = max(totals.end_time, row['end_time'])
+
+        for desc, duration in _interval_samples(row):
+            sketch = self._sketches.get((group, desc))
+            if sketch is None:
+                sketch = QuantileSketch(self._relative_accuracy)
+                self._sketches[(group, desc)] = sketch
+            sketch.add(duration)
+
+    def merge(self, other):
+        if other._group_by != self._group_by:
+            raise ValueError('Only aggregators with the same group_by can be merged.')
+        for key, sketch in other._sketches.items():
+            if key in self._sketches:
+                self._sketches[key].merge(sketch)
+            else:
+                self._sketches[key] = QuantileSketch.from_dict(sketch.to_dict())
+        for group, totals in other._totals.items():
+            self._totals.setdefault(group, _GroupTotals()).merge(totals)
+        return self
+
+    def summary(self, percentiles=DEFAULT_PERCENTILES):
+        """
+        Returns one row (an OrderedDict) per group and interval, with the
+        columns described in summarize().
+        """
+        rows = []
+        for (group, desc), sketch in self._sketches.items():
+            row = collections.OrderedDict([
+                (self._group_by, group),
+                ('interval', desc),
+                ('count', sketch.count),
+                ('mean', sketch.mean),
+                ('min', sketch.min),
+                ('max', sketch.max)
+            ])
+            for p in percentiles:
+                row[_percentile_name(p)] = sketch.quantile(p / 100.)
+            row.update(self._totals[group].values())
+            rows.append(row)
+        return rows
+
+
+def _as_float_array(values):
+    import numpy as np
+
+    if values.dtype == object:
+        return np.array([np.nan if v is None else v for v in values], dtype=float)
+    return values.astype(float)
+
+
+def summarize(stats, group_by='base_name', percentiles=DEFAULT_PERCENTILES):
+    """
+    Exact, vectorized latency summary of a set of query stats.
+
+    Parameters
+    ----------
+    stats : StatsStore or list of QueryStats
+        The stats to summarize.
+    group_by : str
+        The column to group queries by, by default the service's base_name.
+    percentiles : sequence of float
+        The percentiles (0-100) to compute.
+
+    Returns
+    -------
+    list of OrderedDict
+        One row per group and interval (or phase) description, with the
+        columns: <group_by>, interval, count, mean, min, max, one p<N> column
+        per percentile, and for the group as a whole, queries, error_rate
+        (the fraction of queries with no HTTP status or a status >= 400) and
+        throughput (queries per second over the group's time span).
+    """
+    import numpy as np
+
+    if not isinstance(stats, StatsStore):
+        store = StatsStore()
+        store.extend(stats)
+        stats = store
+    if len(stats) == 0:
+        return []
+
+    arrays = stats.to_arrays()
+    groups = np.array([str(g) for g in arrays[group_by]], dtype=object)
+
+    # Per-group totals.
+    totals = collections.OrderedDict()
+    status = _as_float_array(arrays['status']) if 'status' in arrays else np.full(len(stats), np.nan)
+    errors = ~(status < 400)
+    start = _as_float_array(arrays['start_time'])
+    end = _as_float_array(arrays['end_time'])
+    group_names, group_index = np.unique(groups, return_inverse=True)
+    for g, name in enumerate(group_names):
+        member = group_index == g
+        group_totals = _GroupTotals()
+        group_totals.queries = int(member.sum())
+        group_totals.errors = int(errors[member].sum())
+        if np.isfinite(start[member]).any():
+            group_totals.start_time = float(np.nanmin(start[member]))
+            group_totals.end_time = float(np.nanmax(end[member]))
+        totals[name] = group_totals
+
+    # Gather (group, interval description, duration) samples.
+    sample_groups, sample_descs, sample_durations = [], [], []
+    i = 0
+    while f'int{i}_desc' in arrays:
+        sample_groups.append(groups)
+        sample_descs.append(arrays[f'int{i}_desc'])
+        sample_durations.append(_as_float_array(arrays[f'int{i}_duration']))
+        i += 1
+    for phase in QueryStats.PHASES:
+        if f'{phase}_duration' in arrays:
+            sample_groups.append(groups)
+            sample_descs.append(np.full(len(stats), phase, dtype=object))
+            sample_durations.append(_as_float_array(arrays[f'{phase}_duration']))
+    if not sample_durations:
+        return []
+
+    sample_groups = np.concatenate(sample_groups)
+    sample_descs = np.concatenate(sample_descs)
+    sample_durations = np.concatenate(sample_durations)
+    keep = np.isfinite(sample_durations) & np.array([d is not None for d in sample_descs])
+    sample_groups = sample_groups[keep].astype(str)
+    sample_descs = sample_descs[keep].astype(str)
+    sample_durations = sample_durations[keep]
+    if len(sample_durations) == 0:
+        return []
+
+    order = np.lexsort((sample_descs, sample_groups))
+    sample_groups = sample_groups[order]
+    sample_descs = sample_descs[order]
+    sample_durations = sample_durations[order]
+    boundaries = np.flatnonzero((sample_groups[1:] != sample_groups[:-1]) |
+                                (sample_descs[1:] != sample_descs[:-1])) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(sample_durations)]))
+
+    # The values are converted to plain Python types, as LatencyAggregator
+    # gives, so that the rows can be serialized (e.g., as JSON).
+    rows = []
+    for s, e in zip(starts.tolist(), ends.tolist()):
+        durations = sample_durations[s:e]
+        row = collections.OrderedDict([
+            (group_by, str(sample_groups[s])),
+            ('interval', str(sample_descs[s])),
+            ('count', e - s),
+            ('mean', float(durations.mean())),
+            ('min', float(durations.min())),
+            ('max', float(durations.max()))
+        ])
+        for p, value in zip(percentiles, np.percentile(durations, percentiles)):
+            row[_percentile_name(p)] = float(value)
+        row.update(totals[sample_groups[s]].values())
+        rows.append(row)
+    return rows
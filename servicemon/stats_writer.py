@@ -0,0 +1,161 @@
+import csv
+import json
+import numbers
+import pathlib
+import threading
+import time
+
+
+class StatsWriter():
+    """
+    Writes one row per completed query as soon as it is handed over, so a long
+    run keeps constant memory, loses at most the unflushed rows if it dies,
+    and can be followed with tail -f.
+
+    The output is flushed after every flush_every rows, or on the first write
+    at least flush_interval seconds after the previous flush, whichever comes
+    first.  write() may be called from several threads.
+
+    Subclasses implement _write_row() and _close().
+    """
+    def __init__(self, path, flush_every=100, flush_interval=5.0):
+        self._path = pathlib.Path(path)
+        self._flush_every = flush_every
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._unflushed = 0
+        self._last_flush = time.time()
+        self._num_rows = 0
+        self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def num_rows(self):
+        return self._num_rows
+
+    def write(self, stats):
+        """
+        Write the row for one QueryStats.
+        """
+        self.write_row(stats.row_dict())
+
+    def write_row(self, row):
+        """
+        Write a row given as a mapping of column name to value.
+        """
+        with self._lock:
+            self._write_row(row)
+            self._num_rows += 1
+            self._unflushed += 1
+            if (self._unflushed >= self._flush_every or
+                    time.time() - self._last_flush >= self._flush_interval):
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._close()
+
+    def _flush(self):
+        if self._fd is not None:
+            self._fd.flush()
+        self._unflushed = 0
+        self._last_flush = time.time()
+
+    def _write_row(self, row):
+        raise NotImplementedError
+
+    def _close(self):
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+
+def _json_value(value):
+    # numpy scalars and other number-like values aren't JSON serializable.
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, numbers.Real):
+        return float(value)
+    return str(value)
+
+
+class JsonLinesStatsWriter(StatsWriter):
+    """
+    Writes each row as one JSON object per line.  Rows may have any columns.
+    """
+    def __init__(self, path, flush_every=100, flush_interval=5.0):
+        super().__init__(path, flush_every=flush_every, flush_interval=flush_interval)
+        self._fd = open(self._path, 'w')
+
+    def _write_row(self, row):
+        self._fd.write(json.dumps(row, default=_json_value) + '\n')
+
+
+class CsvStatsWriter(StatsWriter):
+    """
+    Writes rows as CSV.  The header is taken from the first row.  Rows missing
+    some of the header's columns get empty fields.  A row with columns not in
+    the header (e.g., a query with more intervals, or extra result_meta keys)
+    starts a new file, <stem>.1<suffix>, <stem>.2<suffix>, ..., whose header
+    adds the new columns, so that every file stays a valid CSV table.
+    """
+    def __init__(self, path, flush_every=100, flush_interval=5.0):
+        super().__init__(path, flush_every=flush_every, flush_interval=flush_interval)
+        self._columns = None
+        self._column_set = None
+        self._segment = 0
+        self._writer = None
+        self._paths = []
+
+    @property
+    def paths(self):
+        # The files written so far, in order.
+        return list(self._paths)
+
+    def _write_row(self, row):
+        if self._columns is None:
+            self._start_segment(list(row.keys()))
+        else:
+            if any(name not in self._column_set for name in row.keys()):
+                self._start_segment(self._merge_columns(row.keys()))
+        self._writer.writerow(['' if row.get(name) is None else row[name]
+                               for name in self._columns])
+
+    def _merge_columns(self, row_columns):
+        # Each new column goes right after the column that precedes it in the
+        # row, so e.g. int2_desc lands next to int1_duration, not at the end.
+        columns = list(self._columns)
+        position = 0
+        for name in row_columns:
+            if name in self._column_set:
+                position = columns.index(name) + 1
+            else:
+                columns.insert(position, name)
+                position += 1
+        return columns
+
+    def _start_segment(self, columns):
+        self._flush()
+        self._close()
+        if self._segment == 0:
+            path = self._path
+        else:
+            path = self._path.with_name(f'{self._path.stem}.{self._segment}{self._path.suffix}')
+        self._segment += 1
+        self._paths.append(path)
+
+        self._columns = columns
+        self._column_set = set(columns)
+        self._fd = open(path, 'w', newline='')
+        self._writer = csv.writer(self._fd, lineterminator='\n')
+        self._writer.writerow(columns)
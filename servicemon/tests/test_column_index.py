@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip('requests')
+table = pytest.importorskip('astropy.table')
+
+from servicemon.navoutils import utils  # noqa: E402
+
+
+def make_table():
+    return table.Table([table.Column([1.0, 2.0], name='a', meta={'ucd': 'u.a'}),
+                        table.Column([3.0, 4.0], name='b', meta={'ucd': 'u.b'}),
+                        table.Column([5.0, 6.0], name='c', meta={'utype': 't.c'})])
+
+
+def test_lookups():
+    t = make_table()
+    assert utils.find_column_by_ucd(t, 'u.a').name == 'a'
+    assert utils.find_column_by_utype(t, 't.c').name == 'c'
+    assert utils.find_column_by_ucd(t, 'u.z') is None
+    assert utils.column_index(t) is utils.column_index(t)
+
+
+def test_column_swapped_without_changing_the_count():
+    t = make_table()
+    assert utils.find_column_by_ucd(t, 'u.b').name == 'b'
+
+    t.remove_column('b')
+    t['d'] = table.Column([7.0, 8.0], meta={'ucd': 'u.d'})
+    assert utils.find_column_by_ucd(t, 'u.d').name == 'd'
+    assert utils.find_column_by_ucd(t, 'u.b') is None
+
+
+def test_column_replaced_with_new_metadata():
+    t = make_table()
+    assert utils.find_column_by_ucd(t, 'u.a').name == 'a'
+
+    t.replace_column('a', table.Column([9.0, 10.0], name='a', meta={'ucd': 'u.new'}))
+    assert utils.find_column_by_ucd(t, 'u.new').name == 'a'
+    assert utils.find_column_by_ucd(t, 'u.a') is None
+
+    t['a'] = table.Column([11.0, 12.0], meta={'ucd': 'u.newer'})
+    assert utils.find_column_by_ucd(t, 'u.newer').name == 'a'
+    assert utils.find_column_by_ucd(t, 'u.new') is None
@@ -0,0 +1,83 @@
+import threading
+import time
+
+from servicemon.query_runner import AsyncQueryRunner, ThreadPoolQueryRunner
+
+
+class FakeQuery():
+    """
+    Stands in for Query, tracking how many runs overlap.
+    """
+    lock = threading.Lock()
+    active = {}
+    peak = {}
+
+    def __init__(self, access_url, fail=False):
+        self.access_url = access_url
+        self.stats = object()
+        self.failed = False
+        self._fail = fail
+
+    def run(self):
+        with FakeQuery.lock:
+            for key in ('all', self.access_url):
+                FakeQuery.active[key] = FakeQuery.active.get(key, 0) + 1
+                FakeQuery.peak[key] = max(FakeQuery.peak.get(key, 0), FakeQuery.active[key])
+        time.sleep(0.01)
+        with FakeQuery.lock:
+            for key in ('all', self.access_url):
+                FakeQuery.active[key] -= 1
+        if self._fail:
+            raise RuntimeError('boom')
+
+    def record_failure(self):
+        self.failed = True
+
+
+def check_runner(runner):
+    FakeQuery.active.clear()
+    FakeQuery.peak.clear()
+    queries = [FakeQuery(f'http://host{i % 3}/cone', fail=(i == 4)) for i in range(12)]
+
+    stats = runner.run(queries)
+
+    # The failed query's stats are kept, marked as failed.
+    assert stats == [q.stats for q in queries]
+    assert [q.failed for q in queries] == [i == 4 for i in range(12)]
+    assert FakeQuery.peak['all'] <= 4
+    for i in range(3):
+        assert FakeQuery.peak[f'http://host{i}/cone'] <= 2
+
+
+def test_async_runner_limits_and_order():
+    check_runner(AsyncQueryRunner(max_concurrent=4, max_per_service=2))
+
+
+def test_thread_pool_runner_limits_and_order():
+    check_runner(ThreadPoolQueryRunner(max_concurrent=4, max_per_host=2))
+
+
+def check_runner_survives_failing_callback(runner):
+    queries = [FakeQuery('http://host0/cone') for i in range(10)]
+    seen = []
+
+    def on_complete(stats):
+        seen.append(stats)
+        raise OSError('disk full')
+
+    try:
+        runner.run(queries, on_complete=on_complete)
+    except OSError:
+        pass
+    else:
+        assert False, 'the callback error was not raised'
+    # Every query still ran.
+    assert len(seen) == 10
+
+
+def test_async_runner_survives_failing_callback():
+    check_runner_survives_failing_callback(AsyncQueryRunner(max_concurrent=4, max_per_service=2))
+
+
+def test_thread_pool_runner_survives_failing_callback():
+    check_runner_survives_failing_callback(ThreadPoolQueryRunner(max_concurrent=2, max_per_host=1))
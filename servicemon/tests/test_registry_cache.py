@@ -0,0 +1,71 @@
+import pytest
+
+pytest.importorskip('astroquery')
+table = pytest.importorskip('astropy.table')
+
+from servicemon.navoutils import registry  # noqa: E402
+from servicemon.navoutils.registry_cache import RegistryCache  # noqa: E402
+
+ADQL = 'SELECT ivoid FROM rr.resource'
+
+
+class Loader():
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def services(*ivoids):
+    return table.Table([list(ivoids)], names=('ivoid',), dtype=(str,))
+
+
+def test_fresh_result_is_served_from_the_cache(tmp_path):
+    cache = RegistryCache(tmp_path)
+    loader = Loader(services('ivo://a', 'ivo://b'))
+    assert len(cache.fetch(ADQL, loader)) == 2
+    cached = cache.fetch(ADQL, loader)
+    assert list(cached['ivoid']) == ['ivo://a', 'ivo://b']
+    assert loader.calls == 1
+
+
+def test_empty_result_is_not_cached(tmp_path):
+    cache = RegistryCache(tmp_path)
+    loader = Loader(table.Table(), services('ivo://a'))
+    assert len(cache.fetch(ADQL, loader)) == 0
+    assert len(cache.fetch(ADQL, loader)) == 1
+    assert loader.calls == 2
+
+
+def test_stale_result_is_served_when_the_query_fails(tmp_path):
+    cache = RegistryCache(tmp_path, ttl=0, stale_while_revalidate=False)
+    cache.put(ADQL, services('ivo://a'))
+    for result in (table.Table(), IOError('registry down')):
+        stale = cache.fetch(ADQL, Loader(result))
+        assert list(stale['ivoid']) == ['ivo://a']
+
+
+class FakeResponse():
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self._content = content
+        self.url = 'http://registry.example.com/sync'
+        self.encoding = 'utf-8'
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError('HTTP status {}'.format(self.status_code))
+
+
+def test_failed_registry_query_raises():
+    with pytest.raises(IOError):
+        registry._result_table(FakeResponse(503, b'Service unavailable'))
+    with pytest.raises(ValueError):
+        registry._result_table(FakeResponse(200, b'<html>Not a VOTable</html>'))
@@ -0,0 +1,72 @@
+from servicemon.navoutils.response_cache import ResponseCache
+
+
+class FakeResponse():
+    def __init__(self, status_code, body=b'', headers=None, url='http://example.com/sia'):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.url = url
+        self._body = body
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self._body), chunk_size):
+            yield self._body[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeServer():
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.sent_headers = []
+
+    def send(self, headers):
+        self.sent_headers.append(headers)
+        return self.responses.pop(0)
+
+
+def test_key_normalizes_params():
+    assert (ResponseCache.key('HTTP://Example.com/cone?', {'RA': 1.5, 'DEC': 2}) ==
+            ResponseCache.key('http://example.com/cone', [('DEC', '2'), ('RA', '1.5')]))
+    assert ResponseCache.key('http://example.com/cone', {'RA': 1}) != ResponseCache.key('http://example.com/cone', {'RA': 2})
+
+
+def test_revalidation_and_counters(tmp_path):
+    cache = ResponseCache(tmp_path)
+    server = FakeServer([FakeResponse(200, b'<VOTABLE/>', {'ETag': '"v1"'}),
+                         FakeResponse(304)])
+
+    first = cache.fetch('http://example.com/sia', {'POS': '1,2'}, server.send)
+    assert first.raw.read() == b'<VOTABLE/>'
+    first.raw.close()
+    second = cache.fetch('http://example.com/sia', {'POS': '1,2'}, server.send)
+    assert second.from_cache
+    assert second.raw.read() == b'<VOTABLE/>'
+    second.raw.close()
+
+    assert server.sent_headers == [None, {'If-None-Match': '"v1"'}]
+    stats = cache.stats()
+    assert (stats['misses'], stats['revalidated'], stats['entries']) == (1, 1, 1)
+
+
+def test_shared_bodies_and_lru_eviction(tmp_path):
+    cache = ResponseCache(tmp_path, max_bytes=10)
+    server = FakeServer([FakeResponse(200, b'aaaaaa'), FakeResponse(200, b'aaaaaa'),
+                         FakeResponse(200, b'bbbbbb')])
+
+    for pos in ('1', '2', '3'):
+        cache.fetch('http://example.com/sia', {'POS': pos}, server.send).raw.close()
+
+    # The first two share a body; the third pushes the total over max_bytes.
+    stats = cache.stats()
+    assert stats['evicted'] == 2
+    assert stats['entries'] == 1
+    assert cache.total_bytes == 6
+
+    # A new ResponseCache on the same directory sees the surviving entry.
+    reopened = ResponseCache(tmp_path, max_bytes=10)
+    response = reopened.fetch('http://example.com/sia', {'POS': '3'}, FakeServer([]).send)
+    assert response.raw.read() == b'bbbbbb'
+    response.raw.close()
+    assert reopened.stats()['hits'] == 1
@@ -0,0 +1,49 @@
+import time
+
+from servicemon.navoutils.retry import CircuitBreaker, CircuitBreakers, RetryBudget, RetryPolicy
+
+
+def test_breaker_opens_and_recovers():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+    # Only one trial request at a time.
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.failures == 0
+
+
+def test_breakers_are_per_host():
+    breakers = CircuitBreakers(failure_threshold=1)
+    breakers.for_url('http://Down.example.com/cone?').record_failure()
+    assert breakers.is_open('http://down.example.com/other')
+    assert not breakers.is_open('http://up.example.com/cone?')
+    assert breakers.states() == {'down.example.com': 'open', 'up.example.com': 'closed'}
+
+
+def test_policy_delays_and_budget():
+    policy = RetryPolicy(base_delay=1., multiplier=2., max_delay=3., jitter=False)
+    assert [policy.delay(n) for n in (1, 2, 3)] == [1., 2., 3.]
+    jittered = RetryPolicy(base_delay=1., jitter=True)
+    assert all(0 <= jittered.delay(2) <= 2. for _ in range(100))
+
+    budget = RetryBudget(ratio=0.5, initial_tokens=1, max_tokens=2)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
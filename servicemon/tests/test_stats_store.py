@@ -0,0 +1,82 @@
+import io
+
+import pytest
+
+from servicemon.query_stats import Interval, QueryStats
+from servicemon.stats_store import StatsStore
+
+
+def make_stats(name, num_intervals, result_meta):
+    stats = QueryStats(name, 'CSC', 'cone', 'http://example.com/cone?',
+                       {'RA': 10.5, 'DEC': -20.25, 'SR': 0.1})
+    for i in range(num_intervals):
+        stats.add_interval(Interval(f'step{i}', 100.0 + i, 100.5 + i))
+    stats.result_meta = result_meta
+    return stats
+
+
+def test_rows_with_different_columns():
+    store = StatsStore()
+    store.append(make_stats('q0', 1, {'status': 200}))
+    store.append(make_stats('q1', 2, {'status': 500, 'num_rows': 7}))
+
+    assert len(store) == 2
+    assert store[0]['int1_duration'] is None
+    assert store[1]['int1_duration'] == 0.5
+    assert store[0]['num_rows'] is None
+    assert store[-1]['num_rows'] == 7
+    assert store[0]['status'] == 200
+
+    out = io.StringIO()
+    store.write_csv(out)
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 3
+    header = lines[0].split(',')
+    assert header[:5] == ['name', 'start_time', 'end_time', 'int0_desc', 'int0_duration']
+    assert 'int1_desc' in header and header[-1] == 'num_rows'
+    row0 = dict(zip(header, lines[1].split(',')))
+    assert row0['status'] == '200'
+    assert row0['num_rows'] == ''
+    assert row0['start_time'] == '100.0'
+
+
+def test_column_becomes_object_on_mixed_values():
+    store = StatsStore()
+    store.append_row({'a': 1})
+    store.append_row({'a': 'x'})
+    store.append_row({})
+    assert [store[i]['a'] for i in range(3)] == [1, 'x', None]
+
+
+def test_column_snapshot_does_not_block_appends():
+    np = pytest.importorskip('numpy')
+
+    store = StatsStore()
+    store.append_row({'size': 1})
+    snapshot = store.column('size')
+    store.append_row({'size': 2})
+    snapshot[0] = 99
+    assert store.value('size', 0) == 1
+    assert np.array_equal(store.column('size'), [1, 2])
+
+
+def test_leading_missing_values_keep_a_column_numeric():
+    np = pytest.importorskip('numpy')
+
+    store = StatsStore()
+    # As for a failed query, whose durations and status are None.
+    store.append_row({'status': None, 'duration': None, 'name': None})
+    store.append_row({'status': 200, 'duration': 0.5, 'name': 'q1'})
+    store.append_row({'status': None, 'duration': None, 'name': None})
+
+    status = store.column('status')
+    assert status.dtype == np.float64
+    assert np.isnan(status[0]) and status[1] == 200 and np.isnan(status[2])
+    assert store.column('duration').dtype == np.float64
+    assert store.column('name').dtype == object
+    assert [store[i]['status'] for i in range(3)] == [None, 200, None]
+
+    empty = StatsStore()
+    empty.append_row({'status': None})
+    assert np.isnan(empty.column('status')).all()
+    assert empty[0]['status'] is None
@@ -0,0 +1,112 @@
+import json
+import pathlib
+import random
+import sys
+
+import pytest
+
+# stats_summary imports the other servicemon modules as top-level modules, as
+# when it is run from the servicemon directory.
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from query_stats import Interval, QueryStats  # noqa: E402
+from stats_store import StatsStore  # noqa: E402
+from stats_summary import LatencyAggregator, QuantileSketch, summarize  # noqa: E402
+
+
+def sample_values(n, seed):
+    rng = random.Random(seed)
+    return [rng.lognormvariate(0, 2) for i in range(n)]
+
+
+def test_quantiles_within_relative_accuracy():
+    values = sample_values(5000, 1) + [0.0] * 50
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    ordered = sorted(values)
+    assert sketch.count == len(values)
+    assert sketch.min == ordered[0]
+    assert sketch.max == ordered[-1]
+    assert sketch.mean == pytest.approx(sum(values) / len(values))
+    for q in (0, 0.005, 0.1, 0.5, 0.9, 0.95, 0.99, 0.999, 1):
+        expected = ordered[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - expected) <= 0.01 * expected + 1e-12
+
+
+def test_empty_sketch():
+    sketch = QuantileSketch()
+    assert sketch.count == 0
+    assert sketch.quantile(0.5) is None
+    assert sketch.mean is None and sketch.min is None and sketch.max is None
+    with pytest.raises(ValueError):
+        sketch.add(-1)
+    with pytest.raises(ValueError):
+        sketch.quantile(1.5)
+
+
+def test_merge_matches_single_sketch():
+    values = sample_values(2000, 2)
+    whole = QuantileSketch(0.02)
+    parts = [QuantileSketch(0.02), QuantileSketch(0.02)]
+    for i, value in enumerate(values):
+        whole.add(value)
+        parts[i % 2].add(value)
+
+    merged = parts[0].merge(parts[1])
+    assert merged.to_dict()['buckets'] == whole.to_dict()['buckets']
+    assert merged.count == whole.count
+    assert (merged.min, merged.max) == (whole.min, whole.max)
+    assert merged.mean == pytest.approx(whole.mean)
+    for q in (0.5, 0.9, 0.99):
+        assert merged.quantile(q) == whole.quantile(q)
+
+    with pytest.raises(ValueError):
+        merged.merge(QuantileSketch(0.01))
+
+
+def test_to_dict_round_trip():
+    sketch = QuantileSketch(0.05)
+    for value in sample_values(500, 3) + [0.0]:
+        sketch.add(value)
+
+    copy = QuantileSketch.from_dict(json.loads(json.dumps(sketch.to_dict())))
+    assert copy.to_dict() == sketch.to_dict()
+    for q in (0, 0.25, 0.5, 0.75, 1):
+        assert copy.quantile(q) == sketch.quantile(q)
+
+    empty = QuantileSketch.from_dict(QuantileSketch().to_dict())
+    assert empty.count == 0 and empty.min is None
+
+
+def test_aggregator_counts_failed_queries_as_errors():
+    aggregator = LatencyAggregator()
+    for status in (200, 200, 503, None):
+        aggregator.add_row({'base_name': 'CSC', 'status': status, 'start_time': 0.0,
+                            'end_time': 1.0, 'int0_desc': 'do_query', 'int0_duration': 0.5})
+
+    (row,) = aggregator.summary()
+    assert row['queries'] == 4
+    assert row['error_rate'] == 0.5
+
+
+def test_summary_serializes_to_json():
+    pytest.importorskip('numpy')
+
+    store = StatsStore()
+    for i, status in enumerate((200, 500, None)):
+        stats = QueryStats(f'q{i}', 'CSC', 'cone', 'http://example.com/cone?', {'RA': 1.0})
+        stats.add_interval(Interval('do_query', 100.0 + i, 100.25 + i))
+        stats.add_phase(Interval('ttfb', 100.0 + i, 100.1 + i))
+        stats.result_meta = {'status': status}
+        store.append(stats)
+
+    rows = summarize(store)
+    assert json.loads(json.dumps(rows)) == [dict(row) for row in rows]
+    for row in rows:
+        assert type(row['base_name']) is str and type(row['interval']) is str
+        assert type(row['count']) is int and type(row['queries']) is int
+        assert type(row['mean']) is float and type(row['throughput']) is float
+    do_query = [row for row in rows if row['interval'] == 'do_query'][0]
+    assert do_query['count'] == 3 and do_query['error_rate'] == pytest.approx(2 / 3)
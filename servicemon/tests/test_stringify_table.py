@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip('requests')
+np = pytest.importorskip('numpy')
+table = pytest.importorskip('astropy.table')
+
+from servicemon.navoutils import utils  # noqa: E402
+
+
+def object_column(values):
+    data = np.empty(len(values), dtype=object)
+    data[:] = values
+    return data
+
+
+def test_bytes_columns_are_decoded():
+    t = table.Table()
+    t['ascii'] = object_column([b'ivo://a', b'', b'ivo://b'])
+    t['utf8'] = object_column(['Paris'.encode('utf-8'), 'Orléans'.encode('utf-8'), b'x'])
+    t['masked'] = table.MaskedColumn(object_column([b'a', b'b', b'c']), mask=[False, True, False],
+                                     meta={'ucd': 'meta.id'})
+    t['mixed'] = object_column([b'a', 5, 'Zürich'])
+    t['ra'] = [1.0, 2.0, 3.0]
+
+    utils.stringify_table(t)
+    assert list(t['ascii']) == ['ivo://a', '', 'ivo://b']
+    assert list(t['utf8']) == ['Paris', 'Orléans', 'x']
+    assert t['utf8'].dtype.kind == 'U'
+    assert list(t['masked'].mask) == [False, True, False]
+    assert t['masked'][0] == 'a' and t['masked'].meta['ucd'] == 'meta.id'
+    assert list(t['mixed']) == ['a', '5', 'Zürich']
+    assert t['ra'].dtype == np.float64
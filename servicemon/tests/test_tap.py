@@ -0,0 +1,177 @@
+import io
+
+import pytest
+
+pytest.importorskip('astroquery')
+np = pytest.importorskip('numpy')
+
+from servicemon.navoutils import tap, utils  # noqa: E402
+from servicemon.navoutils.tap import Tap, TapJob, TapJobError  # noqa: E402
+
+ASYNC_URL = 'http://tap.example.com/tap/async'
+JOB_URL = ASYNC_URL + '/job42'
+
+
+class FakeResponse():
+    def __init__(self, text='', status_code=200, url=None, history=()):
+        self.text = text
+        self.content = text.encode('utf-8')
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.url = url
+        self.history = list(history)
+        self.encoding = None
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise IOError('HTTP status {}'.format(self.status_code))
+
+    def close(self):
+        pass
+
+
+class FakeUWS():
+    """
+    Stands in for utils.try_query, answering as a UWS job service whose job
+    goes through the given phases, one per poll.
+    """
+
+    def __init__(self, phases, redirect=True):
+        self.phases = list(phases)
+        self.redirect = redirect
+        self.posts = []
+
+    def __call__(self, url, post_data=None, **kwargs):
+        if post_data is not None:
+            self.posts.append((url, post_data))
+        if url == ASYNC_URL:
+            if self.redirect:
+                return FakeResponse(url=JOB_URL, history=[FakeResponse(status_code=303)])
+            return FakeResponse('<uws:job xmlns:uws="http://www.ivoa.net/xml/UWS/v1.0">'
+                                '<uws:jobId>job42</uws:jobId></uws:job>', url=ASYNC_URL)
+        if url == JOB_URL + '/phase':
+            if post_data is not None:
+                return FakeResponse()
+            phase = self.phases.pop(0) if len(self.phases) > 1 else self.phases[0]
+            return FakeResponse(phase + '\n')
+        if url == JOB_URL + '/error':
+            return FakeResponse('Query syntax error')
+        if url == JOB_URL:
+            return FakeResponse()
+        return FakeResponse(status_code=404)
+
+
+@pytest.fixture
+def uws(monkeypatch):
+    def install(phases, redirect=True):
+        server = FakeUWS(phases, redirect=redirect)
+        monkeypatch.setattr(utils, 'try_query', server)
+        return server
+    return install
+
+
+@pytest.mark.parametrize('redirect', [True, False])
+def test_job_url_from_redirect_or_job_id(uws, redirect):
+    uws(['COMPLETED'], redirect=redirect)
+    job = Tap.submit_job('http://tap.example.com/tap', 'SELECT * FROM t')
+    assert job.url == JOB_URL
+
+
+def test_job_url_not_found():
+    with pytest.raises(ValueError):
+        Tap._job_url(ASYNC_URL, FakeResponse('<html/>'))
+
+
+def test_pending_job_is_run(uws):
+    server = uws(['PENDING', 'EXECUTING', 'COMPLETED'])
+    job = TapJob(JOB_URL)
+    assert job.wait(poll_interval=0) == 'COMPLETED'
+    assert server.posts == [(JOB_URL + '/phase', {'PHASE': 'RUN'})]
+
+
+def test_error_phase_raises_with_summary(uws):
+    uws(['EXECUTING', 'ERROR'])
+    with pytest.raises(TapJobError) as excinfo:
+        TapJob(JOB_URL).result(poll_interval=0)
+    assert excinfo.value.phase == 'ERROR'
+    assert 'Query syntax error' in str(excinfo.value)
+
+
+def test_wait_times_out(uws):
+    uws(['EXECUTING'])
+    with pytest.raises(TapJobError) as excinfo:
+        TapJob(JOB_URL).wait(timeout=0.05, poll_interval=0.01, backoff=1)
+    assert excinfo.value.phase == 'EXECUTING'
+
+
+def test_async_query_deletes_failed_job(uws):
+    server = uws(['ERROR'])
+    with pytest.raises(TapJobError):
+        tap.Tap.query('http://tap.example.com/tap', 'SELECT * FROM t', mode='async')
+    assert (JOB_URL, {'ACTION': 'DELETE'}) in server.posts
+
+
+def test_cone_upload_table_from_positions():
+    cones = tap.cone_upload_table([[10.0, 20.0], [30.0, -40.0]], radius=0.5)
+    assert cones.colnames == ['pos_id', 'ra', 'dec', 'radius']
+    assert list(cones['pos_id']) == [0, 1]
+    assert list(cones['ra']) == [10.0, 30.0] and list(cones['dec']) == [20.0, -40.0]
+    assert list(cones['radius']) == [0.5, 0.5]
+    assert str(cones['ra'].unit) == 'deg' and str(cones['radius'].unit) == 'deg'
+
+    cones = tap.cone_upload_table(np.array([[1.0, 2.0, 0.1], [3.0, 4.0, 0.2]]))
+    assert list(cones['radius']) == [0.1, 0.2]
+    cones = tap.cone_upload_table([5.0, 6.0], radius=[0.3])
+    assert len(cones) == 1 and cones['ra'][0] == 5.0
+
+
+def test_cone_upload_table_from_skycoord():
+    from astropy.coordinates import SkyCoord
+
+    cones = tap.cone_upload_table(SkyCoord([10.0, 11.0], [20.0, 21.0], unit='deg'), radius=[0.1, 0.2])
+    assert np.allclose(cones['ra'], [10.0, 11.0]) and np.allclose(cones['dec'], [20.0, 21.0])
+    assert list(cones['radius']) == [0.1, 0.2]
+
+
+def test_cone_upload_table_needs_radii():
+    with pytest.raises(ValueError):
+        tap.cone_upload_table([[10.0, 20.0]])
+    with pytest.raises(ValueError):
+        tap.cone_upload_table([[1.0, 2.0, 3.0, 4.0]], radius=0.1)
+
+
+RESULT_VOTABLE = """<?xml version="1.0"?>
+<VOTABLE version="1.3" xmlns="http://www.ivoa.net/xml/VOTable/v1.3">
+<RESOURCE type="results"><TABLE>
+<FIELD name="pos_id" datatype="long"/><FIELD name="id" datatype="char" arraysize="*"/>
+<DATA><TABLEDATA><TR><TD>1</TD><TD>src7</TD></TR></TABLEDATA></DATA>
+</TABLE></RESOURCE></VOTABLE>"""
+
+
+def test_batch_cone_search_uploads_cones(monkeypatch):
+    from astropy.table import Table
+
+    calls = []
+
+    def fake_try_query(url, post_data=None, files=None, **kwargs):
+        calls.append((url, post_data, files))
+        return FakeResponse(RESULT_VOTABLE, url=url)
+
+    monkeypatch.setattr(utils, 'try_query', fake_try_query)
+    result = Tap.batch_cone_search('http://tap.example.com/tap', 'cat.src', [[10.0, 20.0], [30.0, 40.0]],
+                                   radius=0.1, ra_column='ra_deg', dec_column='dec_deg', columns='t.id')
+
+    assert list(result['pos_id']) == [1] and list(result['id']) == ['src7']
+    (url, post_data, files), = calls
+    assert url == 'http://tap.example.com/tap/sync?'
+    assert post_data['request'] == 'doQuery' and post_data['lang'] == 'ADQL'
+    assert post_data['upload'] == 'cones,param:uplt'
+    assert post_data['query'] == (
+        "SELECT up.pos_id, t.id FROM cat.src AS t JOIN TAP_UPLOAD.cones AS up "
+        "ON 1=CONTAINS(POINT('ICRS', t.ra_deg, t.dec_deg), CIRCLE('ICRS', up.ra, up.dec, up.radius))")
+
+    filename, content, content_type = files['uplt']
+    assert content_type == 'application/x-votable+xml'
+    uploaded = Table.read(io.BytesIO(content), format='votable')
+    assert list(uploaded['pos_id']) == [0, 1]
+    assert list(uploaded['ra']) == [10.0, 30.0] and list(uploaded['radius']) == [0.1, 0.1]
@@ -0,0 +1,70 @@
+import base64
+import struct
+
+from servicemon.votable_counter import VOTableCounter
+
+
+def votable(fields, data):
+    return f'''<?xml version="1.0"?>
+<VOTABLE version="1.3" xmlns="http://www.ivoa.net/xml/VOTable/v1.3">
+<RESOURCE type="results">
+<TABLE>
+{fields}
+<DATA>{data}</DATA>
+</TABLE>
+<TABLE><FIELD name="other" datatype="int"/><DATA><TABLEDATA><TR><TD>1</TD></TR></TABLEDATA></DATA></TABLE>
+</RESOURCE>
+</VOTABLE>
+'''.encode('utf-8')
+
+
+def count(doc, chunk_size):
+    counter = VOTableCounter()
+    for i in range(0, len(doc), chunk_size):
+        counter.feed(doc[i:i + chunk_size])
+    counter.close()
+    return counter.num_rows, counter.num_columns
+
+
+def stream(data):
+    encoded = base64.b64encode(data).decode('ascii')
+    lines = [encoded[i:i + 60] for i in range(0, len(encoded), 60)]
+    return '<STREAM encoding="base64">\n' + '\n'.join(lines) + '\n</STREAM>'
+
+
+def test_tabledata():
+    fields = '<FIELD name="ra" datatype="double"/><FIELD name="id" datatype="char" arraysize="*"/>'
+    rows = ''.join(f'<TR><TD>{i}</TD><TD>x{i}</TD></TR>' for i in range(25))
+    doc = votable(fields, f'<TABLEDATA>{rows}</TABLEDATA>')
+    for chunk_size in (1, 7, 128, len(doc)):
+        assert count(doc, chunk_size) == (25, 2)
+
+
+def test_binary_fixed_size():
+    fields = ('<FIELD name="ra" datatype="double"/><FIELD name="f" datatype="bit" arraysize="10"/>'
+              '<FIELD name="name" datatype="char" arraysize="8"/>')
+    data = b''.join(struct.pack('>d', i) + b'\x00\x00' + b'abcdefgh' for i in range(33))
+    doc = votable(fields, '<BINARY>' + stream(data) + '</BINARY>')
+    for chunk_size in (1, 13, len(doc)):
+        assert count(doc, chunk_size) == (33, 3)
+
+
+def test_binary2_variable_size():
+    fields = ('<FIELD name="id" datatype="int"/><FIELD name="name" datatype="char" arraysize="*"/>'
+              '<FIELD name="vals" datatype="short" arraysize="2x*"/>')
+    data = b''
+    for i in range(17):
+        name = b'n' * i
+        data += b'\x00' + struct.pack('>i', i) + struct.pack('>I', len(name)) + name
+        data += struct.pack('>I', i % 3) + b'\x00\x01\x00\x02' * (i % 3)
+    doc = votable(fields, '<BINARY2>' + stream(data) + '</BINARY2>')
+    for chunk_size in (1, 11, len(doc)):
+        assert count(doc, chunk_size) == (17, 3)
+
+
+def test_uncountable_documents():
+    fields = '<FIELD name="ra" datatype="double"/>'
+    href = votable(fields, '<BINARY><STREAM href="http://example.com/data"/></BINARY>')
+    assert count(href, 50) == (-1, 1)
+    assert count(b'<html><body>Service unavailable</body></html>', 10) == (-1, -1)
+    assert count(b'<VOTABLE><RESOURCE><TABLE><FIELD', 10) == (-1, -1)
@@ -0,0 +1,239 @@
+import base64
+import binascii
+import struct
+from xml.parsers import expat
+
+# Bytes per element for each VOTable datatype in the BINARY/BINARY2
+# serializations.  'bit' is handled separately since bits are packed.
+_DATATYPE_SIZES = {
+    'boolean': 1,
+    'unsignedByte': 1,
+    'short': 2,
+    'int': 4,
+    'long': 8,
+    'char': 1,
+    'unicodeChar': 2,
+    'float': 4,
+    'double': 8,
+    'floatComplex': 8,
+    'doubleComplex': 16
+}
+
+
+class _BinaryField():
+    """
+    The shape of one FIELD in a binary row:  either a fixed number of bytes,
+    or a 4-byte element count followed by that many items of item_size bytes.
+    """
+    def __init__(self, datatype, arraysize):
+        if datatype not in _DATATYPE_SIZES and datatype != 'bit':
+            raise ValueError(f'Unknown VOTable datatype {datatype}')
+        dims = [] if arraysize is None else arraysize.strip().split('x')
+        self.variable = len(dims) > 0 and dims[-1].endswith('*')
+        fixed_count = 1
+        for dim in (dims[:-1] if self.variable else dims):
+            fixed_count *= int(dim)
+
+        self._is_bit = datatype == 'bit'
+        self._fixed_count = fixed_count
+        if self._is_bit:
+            self.item_size = None
+            self.size = (fixed_count + 7) // 8
+        else:
+            self.item_size = _DATATYPE_SIZES[datatype] * fixed_count
+            self.size = self.item_size
+
+    def variable_size(self, count):
+        # Number of bytes following the count prefix of a variable field.
+        if self._is_bit:
+            return (count * self._fixed_count + 7) // 8
+        return count * self.item_size
+
+
+class _BinaryRowCounter():
+    """
+    Counts the rows in a base64-encoded BINARY or BINARY2 STREAM as the
+    encoded text arrives, without decoding any values.
+    """
+    def __init__(self, fields, binary2):
+        self._fields = fields
+        self._null_mask_size = (len(fields) + 7) // 8 if binary2 else 0
+        self._pending_text = ''
+        self._buffer = b''
+        self._leftover = 0
+        self._field_index = 0
+        self._expect_count = True
+        self.num_rows = 0
+
+        self._row_size = None
+        if not any(field.variable for field in fields):
+            self._row_size = self._null_mask_size + sum(field.size for field in fields)
+
+    def feed_text(self, text):
+        text = self._pending_text + ''.join(text.split())
+        usable = len(text) - len(text) % 4
+        self._pending_text = text[usable:]
+        if usable == 0:
+            return
+        if self._row_size is not None:
+            # All fields are fixed size, so rows can be counted from the
+            # decoded length alone.
+            num_bytes = usable // 4 * 3 - (len(text[:usable]) - len(text[:usable].rstrip('=')))
+            self._count_fixed(num_bytes)
+        else:
+            self._feed_bytes(base64.b64decode(text[:usable]))
+
+    def _count_fixed(self, num_bytes):
+        total = self._leftover + num_bytes
+        if self._row_size > 0:
+            self.num_rows += total // self._row_size
+            self._leftover = total % self._row_size
+        else:
+            self._leftover = total
+
+    def _feed_bytes(self, data):
+        buf = self._buffer + data
+        pos = 0
+        end = len(buf)
+        fields = self._fields
+        while True:
+            if self._field_index == 0 and self._expect_count:
+                # Start of a row; skip the BINARY2 null mask.
+                if end - pos < self._null_mask_size:
+                    break
+                pos += self._null_mask_size
+                self._expect_count = False
+            field = fields[self._field_index]
+            if field.variable:
+                if end - pos < 4:
+                    break
+                count = struct.unpack_from('>I', buf, pos)[0]
+                size = 4 + field.variable_size(count)
+            else:
+                size = field.size
+            if end - pos < size:
+                break
+            pos += size
+            self._field_index += 1
+            if self._field_index == len(fields):
+                self._field_index = 0
+                self._expect_count = True
+                self.num_rows += 1
+        self._buffer = buf[pos:]
+
+    @property
+    def complete(self):
+        # True if the data seen so far ends on a row boundary.
+        return (self._pending_text == '' and len(self._buffer) == 0 and
+                self._leftover == 0 and self._field_index == 0 and
+                self._expect_count)
+
+
+class VOTableCounter():
+    """
+    Incrementally counts the columns (FIELDs) and rows of the first TABLE in a
+    VOTable while the document is being downloaded, so the counts are known as
+    soon as the last chunk arrives, without building an astropy Table.
+
+    TABLEDATA rows are counted from their TR elements.  BINARY and BINARY2
+    rows are counted by walking the decoded stream using the FIELD datatypes
+    and arraysizes.  Rows in FITS or externally referenced (href) streams
+    cannot be counted and are reported as -1, as are both counts when no
+    TABLE is found or the document is not well-formed XML.
+    """
+    def __init__(self):
+        self._parser = expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start_element
+        self._parser.EndElementHandler = self._end_element
+        self._parser.CharacterDataHandler = None
+
+        self._in_table = False
+        self._table_done = False
+        self._fields = []
+        self._num_rows = 0
+        self._rows_countable = True
+        self._binary = None
+        self._binary2 = False
+        self._error = None
+
+    @property
+    def num_columns(self):
+        if self._error is not None or not (self._in_table or self._table_done):
+            return -1
+        return len(self._fields)
+
+    @property
+    def num_rows(self):
+        if self._error is not None or not (self._in_table or self._table_done):
+            return -1
+        if not self._rows_countable:
+            return -1
+        if self._binary is not None:
+            return self._binary.num_rows
+        return self._num_rows
+
+    @property
+    def error(self):
+        """
+        The exception that stopped parsing, if any.
+        """
+        return self._error
+
+    def feed(self, chunk):
+        """
+        Feed the next chunk (bytes) of the document.
+        """
+        if self._error is not None or self._table_done:
+            return
+        try:
+            self._parser.Parse(chunk, False)
+        except (expat.ExpatError, ValueError, binascii.Error) as e:
+            self._error = e
+
+    def close(self):
+        """
+        Signal the end of the document.
+        """
+        if self._error is None and not self._table_done:
+            try:
+                self._parser.Parse(b'', True)
+            except expat.ExpatError as e:
+                self._error = e
+        if self._binary is not None and not self._binary.complete:
+            self._rows_countable = False
+
+    def _start_element(self, name, attrs):
+        name = name.rpartition(':')[2]
+        if not self._in_table:
+            if name == 'TABLE':
+                self._in_table = True
+        elif name == 'FIELD':
+            self._fields.append(attrs)
+        elif name == 'TR':
+            self._num_rows += 1
+        elif name in ('BINARY', 'BINARY2'):
+            self._binary2 = name == 'BINARY2'
+        elif name == 'FITS':
+            self._rows_countable = False
+        elif name == 'STREAM' and self._binary is None:
+            if 'href' in attrs or attrs.get('encoding', 'base64') != 'base64':
+                self._rows_countable = False
+            else:
+                fields = [_BinaryField(f.get('datatype'), f.get('arraysize'))
+                          for f in self._fields]
+                self._binary = _BinaryRowCounter(fields, self._binary2)
+                self._parser.CharacterDataHandler = self._binary.feed_text
+
+    def _end_element(self, name):
+        name = name.rpartition(':')[2]
+        if not self._in_table:
+            return
+        if name == 'STREAM':
+            self._parser.CharacterDataHandler = None
+        elif name == 'TABLE':
+            # Only the first TABLE is counted, as for Table.read().
+            self._in_table = False
+            self._table_done = True
+            self._parser.StartElementHandler = None
+            self._parser.EndElementHandler = None